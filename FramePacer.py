@@ -0,0 +1,59 @@
+"""Pacing of a render loop to a target frame rate.
+
+wait() sleeps until the next frame deadline instead of spinning, so the
+render thread leaves the CPU (and the GIL) to the signal thread between
+frames. Coarse time.sleep gets within spin seconds of the deadline and short
+yields cover the rest. A loop that falls more than a frame behind starts
+again from now instead of rushing frames to catch up.
+
+With vsync on, presenting a frame blocks until the display refresh. wait()
+then wakes half a period early, leaving the final alignment to the swap
+rather than risking a missed refresh and a halved frame rate. With fps=0
+wait() returns at once, so the loop is paced by vsync alone, if at all.
+"""
+import sys
+import time
+from Latency import monotonic
+
+if sys.platform == 'win32':
+    import ctypes
+    def _highResolutionTimer(on):
+        """Ask Windows for 1 ms sleep granularity (the default is up to 15.6 ms)."""
+        if on:
+            ctypes.windll.winmm.timeBeginPeriod(1)
+        else:
+            ctypes.windll.winmm.timeEndPeriod(1)
+else:
+    def _highResolutionTimer(on):
+        pass
+
+class FramePacer(object):
+    def __init__(self, fps=60.0, vsync=False, spin=0.001):
+        self.period = 1.0/fps if fps else 0.0
+        self.vsync, self.spin = vsync, spin
+        self.deadline = None
+        self.late = 0 #Frames that missed their deadline by more than a period
+
+    def start(self):
+        _highResolutionTimer(True)
+        self.deadline = monotonic()
+
+    def stop(self):
+        _highResolutionTimer(False)
+
+    def wait(self):
+        """Sleep until the next frame is due."""
+        if not self.period:
+            return
+        self.deadline += self.period
+        now = monotonic()
+        if now > self.deadline + self.period:
+            self.late += 1
+            self.deadline = now
+            return
+        wake = self.deadline - (self.period/2 if self.vsync else 0.0)
+        remaining = wake - now
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while monotonic() < wake:
+            time.sleep(0) #Yield the GIL and the core while spinning
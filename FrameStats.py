@@ -0,0 +1,73 @@
+"""Frame times of a render loop, readable from another thread or process.
+
+The render loop calls mark() once per presented frame. Frame times (seconds
+between consecutive marks) go into a fixed-size ring. Every frame longer than
+1.5 target intervals also counts round(time/interval) - 1 refreshes as
+dropped. The storage is multiprocessing shared memory written by the render
+loop alone, so readers take a snapshot without locking. A snapshot copied
+while a frame is being marked can be off by that one frame.
+
+    stats = FrameTimes(interval=1/60.0)
+    stats.mark()                        # render loop, after each frame
+    stats.summary()['p99']              # any thread, or the application process
+"""
+import multiprocessing
+import numpy
+from Latency import monotonic
+
+COUNT, DROPPED, LONGEST, TOTAL, LAST, RESET = range(6) #Fields of the shared header
+
+class FrameTimes(object):
+    empty = dict(frames=0, mean=0.0, p50=0.0, p95=0.0, p99=0.0, dropped=0, longest=0.0)
+
+    def __init__(self, capacity=4096, interval=1/60.0):
+        self.capacity, self.interval = capacity, interval
+        self.rawTimes = multiprocessing.RawArray('d', capacity)
+        self.rawHeader = multiprocessing.RawArray('d', 6)
+        self.attach()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['times'], state['header']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def attach(self):
+        self.times = numpy.ctypeslib.as_array(self.rawTimes)
+        self.header = numpy.ctypeslib.as_array(self.rawHeader)
+
+    def mark(self):
+        """Record the end of a frame. Render loop only."""
+        now, header = monotonic(), self.header
+        if header[RESET]:
+            header[:] = 0
+        elif header[LAST]:
+            dt = now - header[LAST]
+            count = int(header[COUNT])
+            self.times[count % self.capacity] = dt
+            if dt > 1.5*self.interval:
+                header[DROPPED] += round(dt/self.interval) - 1
+            if dt > header[LONGEST]:
+                header[LONGEST] = dt
+            header[TOTAL] += dt
+            header[COUNT] = count + 1 #Last, so readers never see a slot before it is written
+        header[LAST] = now
+
+    def reset(self):
+        """Start counting afresh from the next frame. Any thread."""
+        self.header[RESET] = 1
+
+    def summary(self):
+        """Statistics since the last reset, times in seconds: frames, mean, dropped
+        and longest over all frames, p50, p95 and p99 over the latest capacity."""
+        header = self.header.copy()
+        count = int(header[COUNT])
+        if header[RESET] or not count:
+            return dict(self.empty)
+        times = self.times[:min(count, self.capacity)].copy()
+        p50, p95, p99 = numpy.percentile(times, [50, 95, 99])
+        return dict(frames=count, mean=header[TOTAL]/count, p50=p50, p95=p95, p99=p99,
+                    dropped=int(header[DROPPED]), longest=header[LONGEST])
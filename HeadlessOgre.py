@@ -0,0 +1,540 @@
+"""Headless stand-in for the part of ogre.renderer.OGRE the stimuli use.
+
+Scene nodes, entities, skeleton bones, animation states, the camera, lights,
+viewports and overlay text keep their state in plain Python and nothing is
+drawn, so the stimulus, animation and IK code runs without python-ogre, a
+window or a GPU. Time is simulated: Root.renderOneFrame(dt) runs the frame
+listeners for a frame of dt seconds and advances Root.time.
+
+OgreRenderer.setup(headless=True) renders through this module, with
+Application standing in for OgreApplication.Application.
+
+Entities get the skeleton of the .skeleton file named like their mesh, looked
+up in resourcePaths.
+"""
+import os
+import math
+import TailKinematics
+
+resourcePaths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tail')]
+
+class OgreException(StandardError):
+    pass
+
+class Vector3(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        if hasattr(x, '__len__'):
+            x, y, z = x[0], x[1], x[2]
+        self.x, self.y, self.z = float(x), float(y), float(z)
+    def __getitem__(self, ix):
+        return (self.x, self.y, self.z)[ix]
+    def __len__(self):
+        return 3
+    def __add__(self, other):
+        return Vector3(self.x + other[0], self.y + other[1], self.z + other[2])
+    def __sub__(self, other):
+        return Vector3(self.x - other[0], self.y - other[1], self.z - other[2])
+    def __mul__(self, k):
+        return Vector3(self.x*k, self.y*k, self.z*k)
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+    def __ne__(self, other):
+        return not self == other
+    def __repr__(self):
+        return 'Vector3(%g, %g, %g)' % (self.x, self.y, self.z)
+
+class Quaternion(object):
+    def __init__(self, w=1.0, x=0.0, y=0.0, z=0.0):
+        self.w, self.x, self.y, self.z = float(w), float(x), float(y), float(z)
+    def __getitem__(self, ix):
+        return (self.w, self.x, self.y, self.z)[ix]
+    def __repr__(self):
+        return 'Quaternion(%g, %g, %g, %g)' % (self.w, self.x, self.y, self.z)
+
+class Radian(object):
+    def __init__(self, value):
+        self.value = float(value)
+    def valueRadians(self):
+        return self.value
+    def valueDegrees(self):
+        return math.degrees(self.value)
+
+class Degree(Radian):
+    def __init__(self, value):
+        Radian.__init__(self, math.radians(value))
+
+class ColourValue(object):
+    def __init__(self, r=0.0, g=0.0, b=0.0, a=1.0):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+class FrameEvent(object):
+    def __init__(self, timeSinceLastFrame=0.0, timeSinceLastEvent=0.0):
+        self.timeSinceLastFrame = timeSinceLastFrame
+        self.timeSinceLastEvent = timeSinceLastEvent
+
+class FrameListener(object):
+    def __init__(self):
+        pass
+
+class WindowEventListener(object):
+    def __init__(self):
+        pass
+
+class RenderTargetListener(object):
+    def __init__(self):
+        pass
+
+class RenderSystem(object):
+    class Listener(object):
+        def __init__(self):
+            pass
+
+class WindowEventUtilities(object):
+    def messagePump(self):
+        pass
+
+class Iterator(object):
+    """Ogre-style iterator with hasMoreElements() and getNext()."""
+    def __init__(self, items):
+        self.items, self.ix = list(items), 0
+    def hasMoreElements(self):
+        return self.ix < len(self.items)
+    def getNext(self):
+        self.ix += 1
+        return self.items[self.ix - 1]
+
+ST_GENERIC = 1
+GMM_RELATIVE, GMM_PIXELS, GMM_RELATIVE_ASPECT_ADJUSTED = range(3)
+GHA_LEFT, GHA_CENTER, GHA_RIGHT = range(3)
+GVA_TOP, GVA_CENTER, GVA_BOTTOM = range(3)
+
+class SceneBlendType(object):
+    SBT_TRANSPARENT_ALPHA, SBT_TRANSPARENT_COLOUR, SBT_ADD, SBT_MODULATE, SBT_REPLACE = range(5)
+
+class Bone(object):
+    def __init__(self, name, handle, position=(0, 0, 0), orientation=(1, 0, 0, 0)):
+        self.name, self.handle = name, handle
+        self.position = Vector3(position)
+        self.orientation = Quaternion(*orientation)
+        self.parent = None
+        self.manuallyControlled = False
+    def getName(self):
+        return self.name
+    def getHandle(self):
+        return self.handle
+    def getParent(self):
+        return self.parent
+    def getPosition(self):
+        return self.position
+    def setPosition(self, *args):
+        self.position = Vector3(*args)
+    def getOrientation(self):
+        return self.orientation
+    def setOrientation(self, q):
+        self.orientation = q
+
+class Skeleton(object):
+    def __init__(self, bones):
+        self.bones = bones
+        self.byName = dict((bone.name, bone) for bone in bones)
+        self.numBones = len(bones)
+    def getBone(self, key):
+        return self.byName[key] if isinstance(key, basestring) else self.bones[key]
+    def getNumBones(self):
+        return self.numBones
+
+def loadSkeleton(mesh_name):
+    """Skeleton for a mesh from the .skeleton file of the same name, or None."""
+    base = os.path.splitext(os.path.basename(mesh_name))[0] + '.skeleton'
+    for path in resourcePaths:
+        path = os.path.join(path, base)
+        if os.path.exists(path):
+            names, parents, positions, orientations = TailKinematics.readSkeleton(path)
+            bones = [Bone(name, key, p, q) for key, (name, p, q) in enumerate(zip(names, positions, orientations))]
+            for bone, parent in zip(bones, parents):
+                bone.parent = bones[parent] if parent >= 0 else None
+            return Skeleton(bones)
+    return None
+
+class AnimationState(object):
+    def __init__(self, name, length):
+        self.AnimationName, self.length = name, length
+        self.timePosition, self.loop, self.enabled = 0.0, True, False
+    def getAnimationName(self):
+        return self.AnimationName
+    def getLength(self):
+        return self.length
+    def getTimePosition(self):
+        return self.timePosition
+    def setTimePosition(self, t):
+        if self.loop and self.length > 0:
+            t %= self.length
+        self.timePosition = min(max(t, 0.0), self.length)
+    def addTime(self, dt):
+        self.setTimePosition(self.timePosition + dt)
+    def hasEnded(self):
+        return not self.loop and self.timePosition >= self.length
+    def getLoop(self):
+        return self.loop
+    def setLoop(self, value):
+        self.loop = value
+    def getEnabled(self):
+        return self.enabled
+    def setEnabled(self, value):
+        self.enabled = value
+
+class AnimationStateSet(object):
+    def __init__(self):
+        self.states = {}
+    def getAnimationStateIterator(self):
+        return Iterator(self.states[name] for name in sorted(self.states))
+    def getAnimationState(self, name):
+        if name not in self.states:
+            raise OgreException('animation state "%s" not found' % name)
+        return self.states[name]
+    def hasAnimationState(self, name):
+        return name in self.states
+
+class Entity(object):
+    def __init__(self, name, mesh_name):
+        self.name, self.mesh_name = name, mesh_name
+        self.skeleton = loadSkeleton(mesh_name) if isinstance(mesh_name, basestring) else None
+        self.animationStates = AnimationStateSet()
+        self.visible = True
+    def getName(self):
+        return self.name
+    def getSkeleton(self):
+        return self.skeleton
+    def hasSkeleton(self):
+        return self.skeleton is not None
+    def addAnimationState(self, name, length):
+        """Give the entity an animation; the mesh files' animations are not read."""
+        state = self.animationStates.states[name] = AnimationState(name, length)
+        return state
+    def getAllAnimationStates(self):
+        return self.animationStates if self.animationStates.states else None
+    def getAnimationState(self, name):
+        return self.animationStates.getAnimationState(name)
+    def getNumSubEntities(self):
+        return 0
+    def isVisible(self):
+        return self.visible
+    def setVisible(self, value):
+        self.visible = value
+
+class SceneNode(object):
+    def __init__(self, name, position=(0, 0, 0)):
+        self.name = name
+        self.position = Vector3(position)
+        self.scale = Vector3(1, 1, 1)
+        self.children, self.objects = [], []
+        self.visible = True
+    def getName(self):
+        return self.name
+    def createChildSceneNode(self, name='', position=(0, 0, 0)):
+        node = SceneNode(name, position)
+        self.children.append(node)
+        return node
+    def attachObject(self, obj):
+        self.objects.append(obj)
+    def getPosition(self):
+        return self.position
+    def setPosition(self, *args):
+        self.position = Vector3(*args)
+    def translate(self, *args):
+        self.position = self.position + Vector3(*args)
+    def setScale(self, *args):
+        self.scale = Vector3(*args)
+    def setVisible(self, value, cascade=True):
+        self.visible = value
+        for obj in self.objects:
+            obj.setVisible(value)
+        if cascade:
+            for child in self.children:
+                child.setVisible(value)
+
+class Camera(object):
+    def __init__(self, name='Camera'):
+        self.name = name
+        self.position = Vector3()
+        self.direction = Vector3(0, 0, -1)
+        self.nearClipDistance = 1.0
+        self.FOVy = Degree(45.0)
+    def getPosition(self):
+        return self.position
+    def setPosition(self, *args):
+        self.position = Vector3(*args)
+    def lookAt(self, *args):
+        self.direction = Vector3(*args) - self.position
+    def setNearClipDistance(self, value):
+        self.nearClipDistance = value
+    def setFOVy(self, angle):
+        self.FOVy = angle
+
+class Light(object):
+    LT_POINT, LT_DIRECTIONAL, LT_SPOTLIGHT = range(3)
+    def __init__(self, name):
+        self.name, self.type = name, Light.LT_POINT
+        self.position, self.direction = Vector3(), Vector3(0, 0, 1)
+        self.diffuseColour = ColourValue(1, 1, 1)
+    def setType(self, value):
+        self.type = value
+    def setPosition(self, *args):
+        self.position = Vector3(*args)
+    def setDirection(self, *args):
+        self.direction = Vector3(*args)
+    def setDiffuseColour(self, colour):
+        self.diffuseColour = colour
+
+class SceneManager(object):
+    PT_PLANE, PT_CUBE, PT_SPHERE = 'Prefab_Plane', 'Prefab_Cube', 'Prefab_Sphere'
+    def __init__(self, name):
+        self.name = name
+        self.root = SceneNode('Root')
+        self.entities, self.cameras, self.lights = {}, {}, {}
+        self.ambientLight = ColourValue()
+    def getRootSceneNode(self):
+        return self.root
+    def createEntity(self, name, mesh_name):
+        if name in self.entities:
+            raise OgreException('an entity named "%s" already exists' % name)
+        entity = self.entities[name] = Entity(name, mesh_name)
+        return entity
+    def hasEntity(self, name):
+        return name in self.entities
+    def getEntity(self, name):
+        return self.entities[name]
+    def createCamera(self, name):
+        camera = self.cameras[name] = Camera(name)
+        return camera
+    def getCamera(self, name):
+        return self.cameras[name]
+    def createLight(self, name):
+        light = self.lights[name] = Light(name)
+        return light
+    def setAmbientLight(self, colour):
+        self.ambientLight = colour
+
+class Root(object):
+    """Holds the scene managers and frame listeners and the simulated clock:
+    time is the sum of the dt of every frame rendered so far."""
+    _singleton = None
+    def __init__(self, *args):
+        self.frameListeners = []
+        self.sceneManagers = {}
+        self.time, self.frameCount = 0.0, 0
+        Root._singleton = self
+    @staticmethod
+    def getSingleton():
+        return Root._singleton or Root()
+    def getSceneManager(self, name="Default SceneManager"):
+        if name not in self.sceneManagers:
+            self.sceneManagers[name] = SceneManager(name)
+        return self.sceneManagers[name]
+    def createSceneManager(self, kind, name="Default SceneManager"):
+        return self.getSceneManager(name)
+    def addFrameListener(self, listener):
+        self.frameListeners.append(listener)
+    def removeFrameListener(self, listener):
+        self.frameListeners.remove(listener)
+    def renderOneFrame(self, dt=1/60.0):
+        """Run the frame listeners for one frame of dt seconds. As in Ogre, every
+        listener's frameStarted runs before any frameRenderingQueued, and so on.
+        Returns False if a listener asked to stop."""
+        evt = FrameEvent(dt, dt)
+        ok = True
+        listeners = list(self.frameListeners)
+        for name in ('frameStarted', 'frameRenderingQueued'):
+            for listener in listeners:
+                callback = getattr(listener, name, None)
+                if callback and callback(evt) is False:
+                    ok = False
+        self.time += dt
+        self.frameCount += 1
+        for listener in listeners:
+            callback = getattr(listener, 'frameEnded', None)
+            if callback and callback(evt) is False:
+                ok = False
+        return ok
+    def shutdown(self):
+        self.frameListeners = []
+
+class Material(object):
+    def __init__(self, name):
+        self.name = name
+        self.depthWrite, self.sceneBlending = True, None
+    def getName(self):
+        return self.name
+    def clone(self, name):
+        return MaterialManager.getSingleton().create(name)
+    def setDepthWriteEnabled(self, value):
+        self.depthWrite = value
+    def setSceneBlending(self, value):
+        self.sceneBlending = value
+
+class MaterialManager(object):
+    _singleton = None
+    def __init__(self):
+        self.materials = {}
+        MaterialManager._singleton = self
+    @staticmethod
+    def getSingleton():
+        return MaterialManager._singleton or MaterialManager()
+    def create(self, name, group=None):
+        material = self.materials[name] = Material(name)
+        return material
+    def resourceExists(self, name):
+        return name in self.materials
+    def getByName(self, name):
+        return self.materials.get(name)
+
+class Viewport(object):
+    def __init__(self, camera, width, height):
+        self.camera, self.width, self.height = camera, width, height
+        self.backgroundColour = ColourValue()
+    def getCamera(self):
+        return self.camera
+    def getActualWidth(self):
+        return self.width
+    def getActualHeight(self):
+        return self.height
+    def setBackgroundColour(self, colour):
+        self.backgroundColour = colour
+    def getBackgroundColour(self):
+        return self.backgroundColour
+
+class OverlayElement(object):
+    """Panel or TextArea: position, size, caption, font and colours."""
+    def __init__(self, typeName, name):
+        self.typeName, self.name = typeName, name
+        self.children = {}
+        self.childOrder = []
+        self.left, self.top, self.width, self.height = 0.0, 0.0, 0.0, 0.0
+        self.metricsMode, self.materialName = GMM_RELATIVE, ''
+        self.horizontalAlignment, self.verticalAlignment = GHA_LEFT, GVA_TOP
+        self.caption, self.charHeight, self.fontName = '', 0.0, ''
+        self.colourTop, self.colourBottom = ColourValue(1, 1, 1), ColourValue(1, 1, 1)
+        self.visible = True
+    def getName(self):
+        return self.name
+    def getTypeName(self):
+        return self.typeName
+    def addChild(self, element):
+        self.children[element.name] = element
+        self.childOrder.append(element)
+    def getChild(self, name):
+        return self.children[name]
+    def getChildIterator(self):
+        return Iterator(self.childOrder)
+    def setMetricsMode(self, mode):
+        self.metricsMode = mode
+    def setMaterialName(self, name):
+        self.materialName = name
+    def setHorizontalAlignment(self, value):
+        self.horizontalAlignment = value
+    def setVerticalAlignment(self, value):
+        self.verticalAlignment = value
+    def setPosition(self, left, top):
+        self.left, self.top = left, top
+    def setDimensions(self, width, height):
+        self.width, self.height = width, height
+    def getLeft(self):
+        return self.left
+    def getTop(self):
+        return self.top
+    def getWidth(self):
+        return self.width
+    def getHeight(self):
+        return self.height
+    def setCaption(self, text):
+        self.caption = text
+    def getCaption(self):
+        return self.caption
+    def setCharHeight(self, value):
+        self.charHeight = value
+    def getCharHeight(self):
+        return self.charHeight
+    def setFontName(self, name):
+        self.fontName = name
+    def getFontName(self):
+        return self.fontName
+    def setColourTop(self, colour):
+        self.colourTop = colour
+    def getColourTop(self):
+        return self.colourTop
+    def setColourBottom(self, colour):
+        self.colourBottom = colour
+    def getColourBottom(self):
+        return self.colourBottom
+    def show(self):
+        self.visible = True
+    def hide(self):
+        self.visible = False
+    def isVisible(self):
+        return self.visible
+
+class Overlay(object):
+    def __init__(self, name):
+        self.name = name
+        self.elements = []
+        self.visible = False
+    def add2D(self, element):
+        self.elements.append(element)
+    def show(self):
+        self.visible = True
+    def hide(self):
+        self.visible = False
+    def isVisible(self):
+        return self.visible
+
+class OverlayManager(object):
+    _singleton = None
+    def __init__(self):
+        self.overlays, self.elements = {}, {}
+        OverlayManager._singleton = self
+    @staticmethod
+    def getSingleton():
+        return OverlayManager._singleton or OverlayManager()
+    def create(self, name):
+        overlay = self.overlays[name] = Overlay(name)
+        return overlay
+    def getByName(self, name):
+        return self.overlays.get(name)
+    def createOverlayElement(self, typeName, name):
+        if name in self.elements:
+            raise OgreException('an overlay element named "%s" already exists' % name)
+        element = self.elements[name] = OverlayElement(typeName, name)
+        return element
+    def getOverlayElement(self, name):
+        return self.elements[name]
+    def hasOverlayElement(self, name):
+        return name in self.elements
+
+class Application(object):
+    """Headless counterpart of OgreApplication.Application: a fresh Root with
+    the scene OgreApplication.setupScene builds (camera, viewport, light and
+    the "screen"/"visionegg" overlay panels), and no window or render thread."""
+    def __init__(self, width=800, height=600):
+        self.root = Root()
+        MaterialManager()
+        self.overlayManager = OverlayManager()
+        self.sceneManager = self.root.createSceneManager(ST_GENERIC, "Default SceneManager")
+        self.camera = self.sceneManager.createCamera("Camera")
+        self.camera.setNearClipDistance(0.01)
+        self.viewPort = Viewport(self.camera, width, height)
+        self.light = self.sceneManager.createLight("light")
+        self.light.setType(Light.LT_DIRECTIONAL)
+        self.light.setDirection(-0.577, -0.577, -0.577)
+        self.sceneManager.setAmbientLight(ColourValue(0.4, 0.4, 0.4))
+        top_overlay = self.overlayManager.create("TopOverlay")
+        screen_panel = self.overlayManager.createOverlayElement("Panel", "screen")
+        top_overlay.add2D(screen_panel)
+        screen_panel.addChild(self.overlayManager.createOverlayElement("Panel", "visionegg"))
+        top_overlay.show()
+        self.hmd = None
+
+    def renderOneFrame(self, dt=1/60.0):
+        return self.root.renderOneFrame(dt)
+
+    def cleanUp(self):
+        self.root.shutdown()
@@ -2,9 +2,15 @@ import numpy as np
 from random import randint, uniform, random, shuffle
 from math import ceil, sqrt, floor
 import time
+import os
 import OgreRenderer as OgreRenderer
 from OgreRenderer import HandStimulus, Disc, Block, Text
 import SigTools
+import SignalPipeline
+import RingLog
+import Latency
+from PhaseTable import PhaseTable
+from TrajectoryRecorder import TrajectoryRecorder
 from AppTools.Boxes import box
 from AppTools.Displays import fullscreen
 from AppTools.StateMonitors import addstatemonitor, addphasemonitor
@@ -23,6 +29,29 @@ class BciApplication(BciGenericApplication):
             "PythonApp:Design   list    GoCueText=      1 Imagery % % % // Text for cues. Defines N targets",
             "PythonApp:Design   float   MaxThresh=  2.0 % % %       // Maximum value for animations/movements",
             "PythonApp:Design   float   MinThresh=  -2.0 % % %       // Minimum value for animations/movements",
+            "PythonApp:Design   string  Normalizer=  none none % %  // Replace the thresholds with a range adapted on baseline packets: none, welford or quantile",
+            "PythonApp:Design   float   NormalizerWidth=  2.0 2.0 0 % // Standard deviations either side of the mean (welford)",
+            "PythonApp:Design   float   NormalizerQuantile=  0.05 0.05 0 0.5 // Lower quantile; the upper one is 1 minus it (quantile)",
+            "PythonApp:Design   string  NormalizerFile=  % % % %     // Unless Normalizer=none, statistics are loaded from this file if it exists and saved to it at the end of a run",
+            "PythonApp:Design   int     FreezeNormalizer=  0 0 0 1  // Keep the normalizer statistics as loaded instead of adapting them (boolean)",
+            "PythonApp:Feedback int     UseIKTable=  1 1 0 1        // Interpolate a precomputed IK table instead of solving every packet (boolean)",
+            "PythonApp:Feedback string  IKTableFile=  % % % %       // File the IK table is loaded from and saved to (empty: build at every start)",
+            "PythonApp:Feedback int     IKCacheSize=  256 256 0 %   // Number of recent IK solutions to keep (0: no cache)",
+            "PythonApp:Feedback int     SpringFollower=  0 0 0 1    // Track targets with a critically damped spring instead of per-packet slerps (boolean)",
+            "PythonApp:Feedback float   FollowerTimeConstant=  0.08 0.08 0 % // Time constant of the spring follower in seconds",
+            "PythonApp:Feedback float   PredictionHorizon=  0 0 0 %  // Seconds to extrapolate the target ahead to hide latency (0: off)",
+            "PythonApp:Feedback string  TargetFilter=  none none % % // Smoothing of the target per packet: none, ema, oneeuro or biquad",
+            "PythonApp:Feedback float   TargetFilterCutoff=  2.0 2.0 0 % // Cutoff in Hz of the target filter (minimum cutoff for oneeuro)",
+            "PythonApp:Feedback float   TargetFilterBeta=  0.0 0.0 0 % // Speed coefficient of the oneeuro target filter",
+            "PythonApp:Feedback int     RenderProcess=  0 0 0 1     // Render in a separate process instead of a thread (boolean)",
+            "PythonApp:Feedback list    ResourceGroups=  0 % % %    // resources.cfg sections to load at startup; the rest are not loaded (empty: all)",
+            "PythonApp:Feedback string  OgrePathCache=  % % % %     // File the Ogre plugin and resource paths are cached in between starts (empty: off)",
+            "PythonApp:Feedback string  LogFile=  % % % %           // File log messages are appended to (empty: console)",
+            "PythonApp:Feedback string  TrajectoryFile=  % % % %    // Directory prefix per-packet feedback is recorded to, one directory per run (empty: off); angles are those of the target at angleTime",
+            "PythonApp:Trigger  float   TriggerUpper=  1.0 1.0 % %  // Channel 1 level a trigger has to rise above",
+            "PythonApp:Trigger  float   TriggerLower=  0.5 0.5 % %  // Channel 1 level the signal has to return to before the next trigger",
+            "PythonApp:Trigger  float   TriggerDwell=  0.0 0.0 0 %  // Seconds the signal has to stay up before the trigger fires",
+            "PythonApp:Trigger  float   TriggerRefractory=  0.0 0.0 0 % // Seconds after a trigger onset before the next one can start",
             ]
         states = [
             #===================================================================
@@ -37,7 +66,10 @@ class BciApplication(BciGenericApplication):
 
     #############################################################
     def Preflight(self, sigprops):
-        pass
+        self.screen.process = bool(int(self.params['RenderProcess']))
+        self.screen.resourceGroups = list(self.params['ResourceGroups']) or None
+        self.screen.pathCache = self.params['OgrePathCache'] or None
+        self.screen.logFile = self.params['LogFile'] or None #For the render process's own log
         #TODO: Check parameters
 
     #############################################################
@@ -50,37 +82,78 @@ class BciApplication(BciGenericApplication):
         self.xpos = (-23.0, -8.0)
         self.ypos = (3.0, 18.0)
         self.fbpos = (8, -50, -56.5)
-        self.trigger = False
-        self.triggerSig = 0
+        self.mapper = SignalPipeline.SignalMapper(self.min_thresh, self.max_thresh, (self.xpos, self.ypos))
+        normalizerFile = self.params['NormalizerFile']
+        self.normalizer = SignalPipeline.makeNormalizer(self.params['Normalizer'], 2, self.params['NormalizerWidth'].val,
+                                                        self.params['NormalizerQuantile'].val)
+        if self.normalizer and normalizerFile and os.path.exists(normalizerFile): #Saved statistics only when normalizing
+            self.normalizer = SignalPipeline.loadNormalizer(normalizerFile)
+        if self.normalizer:
+            self.normalizer.frozen = bool(int(self.params['FreezeNormalizer']))
+            if self.normalizer.ready:
+                self.mapper.setThresholds(*self.normalizer.range())
+        self.smoother = SignalPipeline.makeFilter(self.params['TargetFilter'], self.nominal['PacketsPerSecond'],
+                                                  self.params['TargetFilterCutoff'].val, self.params['TargetFilterBeta'].val)
+        self.log = RingLog.getLogger()
+        if self.params['LogFile']:
+            self.log.openFile(self.params['LogFile'])
+        self.phaseName = None
+        self.samples = 0 #Samples processed this run; the packet time is samples over the sampling rate
+        self.recorder = None
+        self.triggerDetector = SignalPipeline.TriggerDetector(self.params['TriggerUpper'].val, self.params['TriggerLower'].val,
+                                                              self.nominal['SamplesPerSecond'],
+                                                              self.params['TriggerDwell'].val, self.params['TriggerRefractory'].val)
         
+        #=======================================================================
+        # Phases: states, cue text and cue visibility of each phase, written on
+        # transitions only where they change. A trigger during triggerJudge
+        # branches to relaxcue; otherwise triggerJudge repeats.
+        #=======================================================================
+        self.phaseTable = PhaseTable([
+            dict(name='preRun',       next='triggerJudge', duration=1000.0),
+            dict(name='triggerJudge', next='triggerJudge', duration=1000.0, branch='relaxcue', states={'TriggerJudge': 1}),
+            dict(name='relaxcue',     next='baseline',     duration=1000.0, stimuli={'cue': {'text': "Relax", 'on': True}}),
+            dict(name='baseline',     next='gocue',        duration=4000.0, states={'Baseline': 1}),
+            dict(name='gocue',        next='task',         duration=1000.0, states={'GoCue': 1, 'TargetClass': 1},
+                 stimuli={'cue': {'text': self.params['GoCueText'][0], 'on': True}}),
+            dict(name='task',         next='stopcue',      duration=6000.0, states={'Task': 1, 'TargetClass': 1}),
+            dict(name='stopcue',      next='triggerJudge', duration=1000.0, stimuli={'cue': {'text': "Relax", 'on': True}}),
+            ], states=['Baseline', 'GoCue', 'Task', 'TriggerJudge', 'TargetClass'], stimuli={'cue': {'on': False}})
+
         #=======================================================================
         # Screen
         #=======================================================================
         self.screen.color = (0,0,0) #let's have a black background
         self.scrw,self.scrh = self.screen.size #Get the screen dimensions.
-        self.screen.app.camera.position = (0, 0, 0)
-        self.screen.app.camera.lookAt ((0, -35, -40))
-        self.screen.app.camera.nearClipDistance = 1
-        import ogre.renderer.OGRE as ogre
-        self.screen.app.camera.setFOVy(ogre.Degree(21.2))
+        self.screen.setCamera(position=(0, 0, 0), lookAt=(0, 0, -1), nearClipDistance=1, fovy=27.0)
         
         #=======================================================================
         # Register the cue text stimuli.
         #=======================================================================
-        self.stimulus('cue', z=5, stim=VisualStimuli.Text(text='?', position=(400,400,0), anchor='center', color=(1,1,1), font_size=50, on=True))
+        cue = dict(text='?', position=(400,400,0), anchor='center', color=(1,1,1), font_size=50, on=True)
+        self.stimulus('cue', z=5, stim=self.screen.stimulus('Text', **cue) if self.screen.remote else VisualStimuli.Text(**cue))
         self.stimuli['cue'].on = False
               
         #=======================================================================
         # Create the feedback
         #=======================================================================
-        self.feedback = OgreRenderer.TailStimulus()
+        self.feedback = self.screen.stimulus('TailStimulus', ikCacheSize=int(self.params['IKCacheSize']),
+                                             follow='spring' if int(self.params['SpringFollower']) else 'slerp',
+                                             timeConstant=self.params['FollowerTimeConstant'].val,
+                                             predictionHorizon=self.params['PredictionHorizon'].val)
         self.vx, self.vy = -8, 18
-        self.feedback.inverseKinematics(True, True, self.vx, self.vy, 0)
-        self.screen.app.camera.lookAt ((0, 0, -1))
+        if int(self.params['UseIKTable']):
+            err = self.feedback.useIKTable(self.xpos, self.ypos, path=self.params['IKTableFile'] or None)
+            if err is not None: #None if built in the render process
+                self.log.write("IK table max error: %g rad", err)
+        self.latency = Latency.LatencyTracker()
+        self.screen.latency = self.latency
+        if not self.screen.remote: #The render process cannot reach this tracker, so only 'target' is timed there.
+            self.feedback.latency = self.latency
+        self.feedback.setTarget(self.vx, self.vy, 0, default=True)
         self.fbpos = (10, -13, -45)
-        self.screen.app.camera.setFOVy(ogre.Degree(27.0))
-        self.feedback.node.setPosition(self.fbpos)
-        self.feedback.node.setVisible(True)
+        self.feedback.move(self.fbpos)
+        self.feedback.on = True
         
         #=======================================================================
         # State monitors for debugging.
@@ -111,94 +184,98 @@ class BciApplication(BciGenericApplication):
         
     #############################################################
     def Halt(self):
-        pass
+        RingLog.getLogger().close() #May come before Initialize
 
     #############################################################
     def StartRun(self):
         self.forget('task_start') #Initialize this timekeeper at t=0.
         self.forget('range_ok')
+        self.triggerDetector.reset()
+        self.latency.reset()
+        self.samples = 0
+        self.feedback.resetStats()
+        self.screen.resetFrameStatistics()
+        self.phaseTable.reset()
+        if self.params['TrajectoryFile']:
+            self.recorder = TrajectoryRecorder(self.params['TrajectoryFile'] + time.strftime('-%Y%m%d-%H%M%S'),
+                                               [('time', 'f8'), ('packetTime', 'f8'), ('phase', 'label'), ('vx', 'f4'), ('vy', 'f4'),
+                                                ('triggerOnset', 'f4'), ('angleTime', 'f8'), ('angle0', 'f4'), ('angle', 'f4')])
 
     #############################################################
     def StopRun(self):
-        pass
+        if self.normalizer and self.params['NormalizerFile']:
+            self.normalizer.save(self.params['NormalizerFile'])
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self.screen.remote:
+            self.log.write("Render process: %d targets dropped on a full ring", self.screen.client.ring.dropped)
+        else:
+            if self.feedback.ikCache:
+                self.log.write("IK cache: %d hits, %d misses", self.feedback.ikCache.hits, self.feedback.ikCache.misses)
+            if self.feedback.predictor:
+                p = self.feedback.predictor
+                self.log.write("Target prediction error: rms %g, max %g over %d packets", p.rmsError, p.maxError, p.errorCount)
+            self.log.write("Pose channel: %d targets superseded before a frame took them", self.feedback.poseChannel.superseded)
+        frames = self.screen.frameStatistics()
+        self.log.write("Frames: %d, %d refreshes dropped, longest %.2f ms, mean %.2f ms",
+                       frames['frames'], frames['dropped'], frames['longest']*1e3, frames['mean']*1e3)
+        self.log.write("Frame time: median %.2f ms, 95%% %.2f ms, 99%% %.2f ms", frames['p50']*1e3, frames['p95']*1e3, frames['p99']*1e3)
+        for stage, count, median, p99, worst in self.latency.summary():
+            self.log.write("Latency packet to " + stage + ": %d samples, median %.2f ms, 99%% %.2f ms, max %.2f ms",
+                           count, median*1e3, p99*1e3, worst*1e3)
+        self.log.flush() #The run's summary is in LogFile once the run has stopped
         
     #############################################################
     def Phases(self):
-        # define phase machine using calls to self.phase and self.design
-        self.phase(name='preRun', next='triggerJudge', duration=1000.0)
-        if not self.trigger:
-            self.phase(name='triggerJudge', next='triggerJudge', duration=1000.0)
-        elif self.trigger:
-            self.phase(name='triggerJudge', next='relaxcue', duration=1000.0)
-            self.phase(name='relaxcue', next='baseline', duration=1000.0)
-            self.phase(name='baseline', next='gocue', duration=4000.0)
-            self.phase(name='gocue', next='task', duration=1000.0)
-            self.phase(name='task', next='stopcue',duration=6000.0)
-            self.phase(name='stopcue', next='triggerJudge', duration=1000.0)
-        self.design(start='preRun', new_trial='intertrial') #It's possible to add a stop phase but so far I have been unsuccessful.
+        # define phase machine from the phase table built in Initialize
+        self.phaseTable.define(self, new_trial='intertrial') #It's possible to add a stop phase but so far I have been unsuccessful.
 
     #############################################################
     def Transition(self, phase):
         # Phase information is recorded in a state called PresentationPhase
         # but sometimes it is necessary to have more direct access, 
-        # especially for the Normalizer.
-        self.states['Baseline'] = int(phase in ['baseline'])
-        self.states['GoCue'] = int(phase in ['gocue'])
-        self.states['Task'] = int(phase in ['task'])
-        self.states['TriggerJudge'] = int(phase in ['triggerJudge'])
-        
-        if phase == 'intertrial':
-            pass
-        elif phase == 'relaxcue':
-            self.stimuli['cue'].text = "Relax"
-        elif phase == 'baseline':
-            pass
-        elif phase == 'gocue':
-            self.stimuli['cue'].text = self.params['GoCueText'][0]          #Change the cue text to the target text.
-            self.states['TargetClass'] = 1                                  #Record that the target is now on the screen.
-        elif phase == 'task':                                               #Reset variables relevant for task monitoring.
-            pass
-        elif phase == 'stopcue':
-            self.stimuli['cue'].text = "Relax"
-            self.states['TargetClass'] = 0
-            self.trigger = False
-        elif phase == 'triggerJudge':
-            if self.triggerSig:
-                self.trigger = True
-                self.triggerSig = 0
-            elif not self.triggerSig:
-                self.trigger = False
+        # especially for the Normalizer. The phase table writes those states
+        # and the cue where they change.
+        self.phaseTable.enter(phase, self)
+        self.phaseName = phase
 
-        self.stimuli['cue'].on = phase in ['gocue', 'stopcue','relaxcue']
+        if phase == 'task':                                                 #Reset variables relevant for task monitoring.
+            self.smoother.reset()
+            if self.normalizer and self.normalizer.ready:                   #Map through the range adapted so far.
+                self.mapper.setThresholds(*self.normalizer.range())
         
     #############################################################
     def Process(self, sig):
         #Process is called on every packet/block. This is used for real-time feedback.
+        self.latency.packetIn()
+        self.samples += sig.shape[1]
+        packetTime = self.samples/float(self.nominal['SamplesPerSecond']) #Clocks the predictor by the signal, not by arrival
+        if self.normalizer and self.in_phase('baseline'):
+            self.normalizer.update(np.asarray(sig)[:self.normalizer.channels].mean(axis=1))
         if self.in_phase('task'):
-			x = sig[0,:].mean(axis=1)
-			y = sig[1,:].mean(axis=1)
-			x = x.A.ravel()[0]
-			y = y.A.ravel()[0]
-			x = np.clip( x, self.min_thresh, self.max_thresh )
-			y = np.clip( y, self.min_thresh, self.max_thresh ) # signals should be within the range
-			self.vx = x*(self.xpos[1]-self.xpos[0])/(self.max_thresh-self.min_thresh)+self.xpos[0]-(self.xpos[1]-self.xpos[0])/(self.max_thresh-self.min_thresh)*self.min_thresh
-			self.vy = y*(self.ypos[1]-self.ypos[0])/(self.max_thresh-self.min_thresh)+self.ypos[0]-(self.ypos[1]-self.ypos[0])/(self.max_thresh-self.min_thresh)*self.min_thresh
+            self.vx, self.vy = self.smoother.update(self.mapper.map(sig)) # signals clipped to the thresholds, mapped into the workspace, smoothed
+            self.latency.targetComputed()
 
         # tailWithoutAnimation
         if self.in_phase('task'):
-            self.feedback.inverseKinematics(True, False, self.vx, self.vy, 0.12)
+            self.feedback.setTarget(self.vx, self.vy, 0.12, t=packetTime, stamp=self.latency.packetTime)
             self.states['Default'] = 0
         elif not self.in_phase('task') and not self.states['Default']:
-            self.feedback.inverseKinematics(True, True, self.vx, self.vy, 1)
+            self.feedback.setTarget(self.vx, self.vy, 1, default=True, t=packetTime, stamp=self.latency.packetTime)
             self.states['Default'] = 1
 
-        # trigger
-        self.triggerSig = sig[0,:].mean(axis=1)
-        if self.triggerSig > 1.0:
-            self.triggerSig = 1
-        elif self.triggerSig < 1.0:
-            self.triggerSig = 0
-        print self.triggerSig
+        # trigger: checked on every sample, branches out of the judge window on the packet it fires
+        onset = self.triggerDetector.update(sig[0,:])
+        if self.recorder:
+            # The angles are those of the latest target the render thread has taken, usually the previous
+            # packet's, so angleTime gives that target's packet time to align them by (unknown with a render process).
+            angle0, angle = getattr(self.feedback, 'willAngles', (np.nan, np.nan))
+            self.recorder.append((time.time(), packetTime, self.phaseName, self.vx, self.vy, np.nan if onset is None else onset,
+                                  getattr(self.feedback, 'willTime', np.nan), angle0, angle))
+        if onset is not None and self.in_phase('triggerJudge'):
+            self.log.write("Trigger onset at sample %d of the packet", onset)
+            self.change_phase(self.phaseTable.branch('triggerJudge'))
 		
     #############################################################
     def Frame(self, phase):
@@ -0,0 +1,110 @@
+"""Closed-loop latency from a packet arriving to the frame that shows it.
+
+LatencyTracker takes monotonic timestamps at each stage of the pipeline and
+adds the time since the packet arrived to one LatencyHistogram per stage:
+
+    target     Process has computed the workspace target
+    ik         TailStimulus has the bone orientations for it
+    applied    the first frame writing them to the bones (render thread)
+    presented  renderOneFrame has returned for that frame
+
+Only the latest target is followed through the render thread: a target
+replaced before the render thread takes it (see PoseChannel) is counted up to
+'target' only, and one replaced before its first frame up to 'ik' only.
+"""
+import sys
+import time
+import numpy
+from collections import OrderedDict
+
+if sys.platform == 'win32':
+    monotonic = time.clock #QueryPerformanceCounter
+elif sys.platform.startswith('linux'):
+    import ctypes
+    import ctypes.util
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c')).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    def monotonic():
+        t = _timespec()
+        _clock_gettime(1, ctypes.byref(t)) #CLOCK_MONOTONIC
+        return t.tv_sec + t.tv_nsec*1e-9
+else:
+    monotonic = time.time
+
+class LatencyHistogram(object):
+    """Counts of latencies in bins of binWidth seconds up to maxLatency; longer
+    latencies go into the last bin but still count towards mean and max."""
+    def __init__(self, binWidth=1e-4, maxLatency=0.5):
+        self.binWidth = binWidth
+        self.counts = numpy.zeros(int(round(maxLatency/binWidth)) + 1, dtype=numpy.int64)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, seconds):
+        self.counts[min(max(int(seconds/self.binWidth), 0), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile (0-100), in seconds."""
+        if not self.count:
+            return 0.0
+        ix = numpy.searchsorted(numpy.cumsum(self.counts), q/100.0*self.count)
+        return (ix + 1)*self.binWidth
+
+class LatencyTracker(object):
+    stages = ('target', 'ik', 'applied', 'presented')
+
+    def __init__(self, binWidth=1e-4, maxLatency=0.5):
+        self.histograms = OrderedDict((stage, LatencyHistogram(binWidth, maxLatency)) for stage in self.stages)
+        self.reset()
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.packetTime = None
+        self.submitted = None #Packet time of the latest solved target not yet on the bones
+        self.applied = None #Packet time of the target whose first frame is being rendered
+
+    def packetIn(self):
+        self.packetTime = monotonic()
+
+    def targetComputed(self):
+        if self.packetTime is not None:
+            self.histograms['target'].add(monotonic() - self.packetTime)
+
+    def ikSolved(self, packetTime=None):
+        """packetTime: arrival of the packet the target came from, if not the latest
+        (as when the render thread solves targets published earlier)."""
+        if packetTime is None:
+            packetTime = self.packetTime
+        if packetTime is not None:
+            self.histograms['ik'].add(monotonic() - packetTime)
+            self.submitted = packetTime
+
+    def frameApplied(self):
+        """Call after writing bone orientations; counts only the first frame of a target."""
+        submitted, self.submitted = self.submitted, None
+        if submitted is not None:
+            self.histograms['applied'].add(monotonic() - submitted)
+            self.applied = submitted
+
+    def framePresented(self):
+        applied, self.applied = self.applied, None
+        if applied is not None:
+            self.histograms['presented'].add(monotonic() - applied)
+
+    def summary(self):
+        """[(stage, count, median, 99th percentile, max)], latencies in seconds."""
+        return [(stage, h.count, h.percentile(50), h.percentile(99), h.max) for stage, h in self.histograms.items()]
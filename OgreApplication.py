@@ -5,6 +5,8 @@ import ogre.renderer.OGRE as ogre
 import ogre.io.OIS as OIS
 import math
 import ctypes
+import json
+import RingLog
 
 def getPluginPath():
     """ Return the absolute path to a valid plugins.cfg file.
@@ -50,9 +52,31 @@ def UnitTest_Screenshot():
     else:
         return "test"
 
+def readPathCache(path):
+    """Plugin and resource paths and resource locations saved by savePathCache,
+    or {} if there is no cache or resources.cfg has changed since it was saved."""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if not os.path.exists(cache.get('plugins', '')) or not os.path.exists(cache.get('resources', '')) \
+            or os.path.getmtime(cache['resources']) != cache.get('mtime'):
+        return {}
+    #json gives unicode, Ogre wants str
+    return {'plugins': str(cache['plugins']), 'resources': str(cache['resources']),
+            'locations': [tuple(str(x) for x in location) for location in cache['locations']]}
+
+def savePathCache(path, plugins, resources, locations):
+    with open(path, 'w') as f:
+        json.dump({'plugins': plugins, 'resources': resources, 'mtime': os.path.getmtime(resources),
+                   'locations': locations}, f, indent=1)
+
 class Application(object):
     debugText=""
     app_title = "MyApplication"
+    _resource_groups = None #Resource groups to initialise at startup (None: all); the others wait for loadResourceGroups
+    _path_cache = None #JSON file caching the plugin and resource paths and resource locations between starts
 
     def fakeInit(self):
         """Set some self variables that would normally be set by the BCPy Renderer wrapper."""
@@ -94,25 +118,33 @@ class Application(object):
 
     # The Root constructor for the ogre
     def createRoot(self):
+        self._cache = readPathCache(self._path_cache) if self._path_cache else {}
         if self._plugins_path is None:
-            self._plugins_path = getPluginPath()
+            self._plugins_path = self._cache.get('plugins') or getPluginPath()
         self.root = ogre.Root(self._plugins_path)
 
     # Here the resources are read from the resources.cfg
     def defineResources(self):
         rgm = ogre.ResourceGroupManager.getSingleton()
-        cf = ogre.ConfigFile()
         if self._resource_path is None:
-            self._resource_path = os.path.join(os.path.dirname(self._plugins_path),'resources.cfg')
-        cf.load(self._resource_path)
-        seci = cf.getSectionIterator()
-        while seci.hasMoreElements():
-            secName = seci.peekNextKey()
-            settings = seci.getNext()
-            for item in settings:
-                typeName = item.key
-                archName = item.value
-                rgm.addResourceLocation(archName, typeName, secName)
+            self._resource_path = self._cache.get('resources') or os.path.join(os.path.dirname(self._plugins_path),'resources.cfg')
+        if self._cache.get('resources') == self._resource_path and self._cache.get('plugins') == self._plugins_path:
+            locations = self._cache['locations']
+        else:
+            locations = []
+            cf = ogre.ConfigFile()
+            cf.load(self._resource_path)
+            seci = cf.getSectionIterator()
+            while seci.hasMoreElements():
+                secName = seci.peekNextKey()
+                settings = seci.getNext()
+                for item in settings:
+                    locations.append((item.value, item.key, secName))
+            if self._path_cache:
+                savePathCache(self._path_cache, self._plugins_path, self._resource_path, locations)
+        for archName, typeName, secName in locations:
+            rgm.addResourceLocation(archName, typeName, secName)
+        self.resourceGroups = sorted(set(secName for archName, typeName, secName in locations))
 
     # Create and configure the rendering system (either DirectX or OpenGL) here
     def setupRenderSystem(self): #Delete ogre.cfg to show the config dialog box
@@ -149,7 +181,24 @@ class Application(object):
     # Initialize the resources here (which were read from resources.cfg in defineResources()
     def initializeResourceGroups(self):
         ogre.TextureManager.getSingleton().setDefaultNumMipmaps(5)
-        ogre.ResourceGroupManager.getSingleton().initialiseAllResourceGroups()
+        if self._resource_groups is None:
+            ogre.ResourceGroupManager.getSingleton().initialiseAllResourceGroups()
+            self.deferredGroups = []
+        else:
+            self.deferredGroups = list(self.resourceGroups)
+            self.loadResourceGroups(['General'] + list(self._resource_groups))
+
+    def loadResourceGroups(self, names=None):
+        """Initialise resource groups left out at startup (default: all of them).
+        Names that are not sections of resources.cfg are logged and skipped."""
+        rgm = ogre.ResourceGroupManager.getSingleton()
+        for name in list(self.deferredGroups if names is None else names):
+            if name == 'General' or name in self.deferredGroups: #General is Ogre's default group, declared or not
+                rgm.initialiseResourceGroup(name)
+                if name in self.deferredGroups:
+                    self.deferredGroups.remove(name)
+            elif name not in self.resourceGroups:
+                RingLog.getLogger().write("Resource group " + repr(name).replace('%', '%%') + " is not in resources.cfg, skipped")
 
     # Now, create a scene here. Three things that MUST BE done are sceneManager, camera and
     # viewport initializations
@@ -12,8 +12,6 @@ import sys
 import os
 import os.path
 import time
-import OgreApplication #This is a typical python-ogre style application except it runs in a thread.
-import ogre.renderer.OGRE as ogre
 import BCPy2000.AppTools.Coords as Coords
 try:    from BCI2000PythonApplication    import BciGenericRenderer, BciStimulus   # development copy
 except: from BCPy2000.GenericApplication import BciGenericRenderer, BciStimulus   # installed copy
@@ -21,10 +19,26 @@ import threading
 import Queue
 import math
 import numpy
+import FramePacer
+import FrameStats
+import Latency
+import PoseChannel
+import QuaternionMath
+import RingLog
+import SignalPipeline
+import TailKinematics
 
 class OgreThread(threading.Thread):
     """The thread in which ogre will render itself.
+    Frames are paced to renderer.framerate (see FramePacer), and every control
+    message queued since the last frame is handled before the next one.
+    renderer.frameHook, if set, is called between frames too; it returns False
+    to stop. run() is also the render loop of a render process (see RenderProcess).
+    The time each startup stage takes is logged before the first frame.
     """
+    stages = ('createRoot', 'defineResources', 'setupRenderSystem', 'createRenderWindow',
+              'initializeResourceGroups', 'setupScene', 'createFrameListener')
+
     def __init__(self, queue, renderer, app):
         threading.Thread.__init__(self)
         self.queue = queue
@@ -35,31 +49,92 @@ class OgreThread(threading.Thread):
         #Pass variables from OgreRenderer to OgreApplication
         self.app._plugins_path = self.renderer._plugins_path
         self.app._resource_path = self.renderer._resource_path
+        self.app._resource_groups = self.renderer.resourceGroups
+        self.app._path_cache = self.renderer.pathCache
         #self.app._coords = self.renderer._coords
         #self.app._screen_scale = self.renderer._screen_scale
         #self.app._screen_params = self.renderer._screen_params
-        #Initialize the screen
-        self.app.createRoot()
-        self.app.defineResources()
-        self.app.setupRenderSystem()
-        self.app.createRenderWindow()
-        self.app.initializeResourceGroups()
-        self.app.setupScene()
-        self.app.createFrameListener()
+        #Initialize the screen, timing each stage
+        log = RingLog.getLogger()
+        start = Latency.monotonic()
+        for stage in self.stages:
+            t = Latency.monotonic()
+            try:
+                getattr(self.app, stage)()
+            except BaseException, e:
+                self.queue.put({'Error': e}) #Rather than leave Initialize waiting for Ready
+                raise
+            log.write("Startup: " + stage + " %.1f ms", (Latency.monotonic() - t)*1e3)
+        log.write("Startup: ready to render after %.1f ms", (Latency.monotonic() - start)*1e3)
+        if self.app.deferredGroups:
+            log.write("Startup: %d resource groups deferred", len(self.app.deferredGroups))
         #Tell the Renderer thread we are ready
         self.queue.put({'Ready': True})
         #self.app.startRenderLoop()
+        isVSyncEnabled = getattr(self.app.renderWindow, 'isVSyncEnabled', None) #Ogre 1.8 and later
+        pacer = FramePacer.FramePacer(self.renderer.framerate, isVSyncEnabled() if isVSyncEnabled else False)
+        pump = ogre.WindowEventUtilities()
+        pacer.start()
         msgToStop = False
         while not msgToStop:
-            ogre.WindowEventUtilities().messagePump()
+            pump.messagePump()
             self.app.root.renderOneFrame()
-            try:
-                msg = self.queue.get(True,0.0001)
-                msgToStop = "Stop" in msg.keys() and msg["Stop"]
-            except:
-                msgToStop = False
+            if self.renderer.frameTimes:
+                self.renderer.frameTimes.mark()
+            if self.renderer.latency:
+                self.renderer.latency.framePresented()
+            msgToStop = self.drain()
+            if self.renderer.frameHook and not self.renderer.frameHook():
+                msgToStop = True
+            if not msgToStop:
+                pacer.wait()
+        pacer.stop()
         self.app.cleanUp()
 
+    def drain(self):
+        """Handle every queued message; True if one of them asks to stop."""
+        msgToStop = False
+        while True:
+            try:
+                msg = self.queue.get_nowait()
+            except Queue.Empty:
+                return msgToStop
+            if "LoadGroups" in msg:
+                self.app.loadResourceGroups(msg["LoadGroups"])
+            msgToStop = msgToStop or msg.get("Stop", False)
+
+
+class OgreBackend(object):
+    """The Ogre module this module's scene calls go to: python-ogre, or
+    HeadlessOgre once setup(headless=True) has selected it. python-ogre is only
+    imported when first used, so without it headless rendering still works
+    while anything else raises its ImportError."""
+    def __init__(self):
+        self.module = None
+        self.listenerClasses = {}
+
+    def select(self, headless):
+        if headless:
+            import HeadlessOgre as module
+        else:
+            import ogre.renderer.OGRE as module
+        if self.module is not None and self.module is not module:
+            raise RuntimeError("Ogre backend already set to %s" % self.module.__name__)
+        self.module = module
+
+    def __getattr__(self, name):
+        if self.module is None:
+            self.select(False)
+        return getattr(self.module, name)
+
+    def listener(self, cls, *args):
+        """An instance of cls, a frame listener written as a mixin, combined with
+        the backend's FrameListener."""
+        if cls not in self.listenerClasses:
+            self.listenerClasses[cls] = type(cls.__name__, (cls, self.FrameListener), {})
+        return self.listenerClasses[cls](*args)
+
+ogre = OgreBackend()
 
 class OgreRenderer(BciGenericRenderer):
     debugText=""
@@ -73,6 +148,17 @@ class OgreRenderer(BciGenericRenderer):
         self._coordinate_mapping = 'pixels from center'
         self._bgcolor = (0.5, 0.5, 0.5)
         self._usehmd = False
+        self._headless = False
+        self._size = (800, 600)
+        self.thread = None
+        self.process = False
+        self.client = None #A RenderProcess.RenderClient if rendering in a process
+        self.resourceGroups = None
+        self.pathCache = None
+        self.logFile = None #File the render process appends its log to (None: its console)
+        self.frameHook = None
+        self.frameTimes = None #A FrameStats.FrameTimes the render loop marks every frame in; see frameStatistics
+        self.latency = None #A Latency.LatencyTracker; frames are marked presented after renderOneFrame
 
     def __del__(self):
         "Clear variables, this should not actually be needed."
@@ -82,10 +168,36 @@ class OgreRenderer(BciGenericRenderer):
     def setup(self, width = 800, height = 600, left = 0, top = 0,
             bgcolor = (0.5, 0.5, 0.5), frameless_window = None, title="BCPyOgre",
             plugins_path = None, resource_path = None,
-            coordinate_mapping = 'pixels from center', id=None, scale=None, usehmd=False, **kwds):
+            coordinate_mapping = 'pixels from center', id=None, scale=None, usehmd=False, headless=False,
+            framerate=60.0, process=None, resource_groups=None, path_cache=None, log_file=None, **kwds):
         """BCI2000 parameters relevant to the display are passed in here,
         during the Application Preflight, either directly or through AppTools.Displays.fullscreen, on the main thread.
+        headless=True renders through HeadlessOgre: no window, no GPU, and every
+        FinishFrame advances the simulated clock by one frame.
+        framerate is the rate the render thread paces frames to (0: as fast as
+        vsync or the GPU allows) and the frame length of headless rendering.
+        process=True renders in a separate process instead of a thread (see
+        RenderProcess); create stimuli with stimulus() and set the camera with
+        setCamera() then. It can also be set as .process before Initialize.
+        resource_groups lists the resources.cfg sections to initialise at startup
+        (None: all); the rest wait for loadResourceGroups. path_cache names a
+        file the plugin and resource paths and resources.cfg are cached in
+        between starts. Both can also be set as .resourceGroups and .pathCache.
+        log_file (or .logFile) is the file the render process appends its log,
+        startup timings included, to; the render thread shares the application's.
+        process, resource_groups, path_cache and log_file are only changed when
+        given (not None), so a later setup() keeps what the application set.
         """
+        self._settings = dict(width=width, height=height, left=left, top=top, bgcolor=bgcolor,
+                              frameless_window=frameless_window, title=title, plugins_path=plugins_path,
+                              resource_path=resource_path, coordinate_mapping=coordinate_mapping, id=id,
+                              scale=scale, usehmd=usehmd, headless=headless, framerate=framerate)
+        if resource_groups is not None:
+            self.resourceGroups = resource_groups
+        if path_cache is not None:
+            self.pathCache = path_cache
+        if log_file is not None:
+            self.logFile = log_file
         if usehmd:
             width,height = 600,800
             bgcolor = (0.0, 0.0, 0.0)
@@ -104,29 +216,74 @@ class OgreRenderer(BciGenericRenderer):
                                 "monitorIndex": self._screen_id
                                 }
         self._usehmd = usehmd
+        self.framerate = framerate
+        if process is not None:
+            self.process = process
+        self._headless = headless
+        self._size = (width, height)
+        if headless:
+            ogre.select(True)
 
     def Initialize(self, bci=None):
         #Called after generic preflights, after generic _Initialize, but before application Initialize
         #On the 'visual display' thread
         self._bci = bci
-        self.app = OgreApplication.Application()
-        if self._usehmd:
-            import Rift
-            self.app.hmd = Rift.Rift()
+        self.frameTimes = FrameStats.FrameTimes(interval=1.0/(self.framerate or 60.0))
+        if self.process: #Headless or not, as the render process sees it
+            import RenderProcess
+            self.app = None
+            self.client = RenderProcess.RenderClient(dict(self._settings, framerate=self.framerate, resource_groups=self.resourceGroups,
+                                                          path_cache=self.pathCache, log_file=self.logFile), self.frameTimes)
+            start = Latency.monotonic()
+            self.client.start() #Returns once the render process is ready to render
+            RingLog.getLogger().write("Startup: render process ready after %.1f ms", (Latency.monotonic() - start)*1e3)
+            return
+        elif self._headless:
+            self.app = ogre.Application(*self._size) #Scene state only; FinishFrame renders
         else:
-            self.app.hmd = None
-        self.ogreQ=Queue.Queue()
-        self.thread = OgreThread(self.ogreQ, self, self.app)
-        self.thread.setDaemon(True) #Not sure if necessary
-        self.thread.start() #Kicks off the run().
-        msg = self.ogreQ.get(True, None)#Block progression, with no timeout, until the OgreThread posts it is ready to render
+            import OgreApplication #A typical python-ogre style application except it runs in a thread; needs python-ogre
+            self.app = OgreApplication.Application()
+            if self._usehmd:
+                import Rift
+                self.app.hmd = Rift.Rift()
+            else:
+                self.app.hmd = None
+            self.ogreQ=Queue.Queue()
+            self.thread = OgreThread(self.ogreQ, self, self.app)
+            self.thread.setDaemon(True) #Not sure if necessary
+            start = Latency.monotonic()
+            self.thread.start() #Kicks off the run().
+            msg = self.ogreQ.get(True, None)#Block progression, with no timeout, until the OgreThread posts it is ready to render
+            if 'Error' in msg:
+                raise msg['Error']
+            RingLog.getLogger().write("Startup: render thread ready after %.1f ms", (Latency.monotonic() - start)*1e3)
         self.color = self._bgcolor
         self.coordinate_mapping = self._coordinate_mapping
 
     def GetFrameRate(self):
         if 'FramesPerSecond' in self._bci.estimated:
             return self._bci.estimated['FramesPerSecond']['running']#self.renderWindow.getLastFPS() is too slow to do every frame.
-        else: return self.framerate
+        mean = self.frameStatistics()['mean']
+        return 1.0/mean if mean else self.framerate
+
+    def frameStatistics(self):
+        """Frame times measured by the render loop since the last resetFrameStatistics,
+        in seconds: dict(frames, mean, p50, p95, p99, dropped, longest). dropped counts
+        the refreshes missed against the target framerate. Safe from any thread.
+        Headless rendering records no frame times."""
+        return self.frameTimes.summary() if self.frameTimes else dict(FrameStats.FrameTimes.empty)
+
+    def loadResourceGroups(self, names=None):
+        """Initialise resource groups deferred at startup (default: all of them),
+        between frames. Expect a long frame while they load."""
+        if self.client:
+            self.client.control(('groups', names))
+        elif self.thread:
+            self.ogreQ.put({'LoadGroups': names})
+
+    def resetFrameStatistics(self):
+        if self.frameTimes:
+            self.frameTimes.reset()
 
     def RaiseWindow(self):
         try:
@@ -150,12 +307,54 @@ class OgreRenderer(BciGenericRenderer):
         pass
 
     def FinishFrame(self):
-        pass
+        if self.client:
+            self.client.check() #The render process renders its own frames
+        elif self._headless:
+            self.app.renderOneFrame(1.0/(self.framerate or 60.0))
+            if self.frameTimes: #Wall-clock times between headless frames, as the render thread marks them
+                self.frameTimes.mark()
+            if self.latency:
+                self.latency.framePresented()
 
     def Cleanup(self):
+        if self.client:
+            self.client.stop()
+            return
+        if self._headless:
+            self.app.cleanUp()
+            return
         self.ogreQ.put({'Stop': True})
         #self.ogreQ.join() #Wait until the OgreApplication is cleaned up before continuing
 
+    @property
+    def remote(self):
+        """True if stimuli live in a render process (see stimulus())."""
+        return self.client is not None
+
+    def stimulus(self, kind, **kwargs):
+        """Create a stimulus of class kind (e.g. 'TailStimulus'), in the render
+        process if there is one, in which case a RenderProcess.RemoteStimulus
+        is returned."""
+        cls = globals()[kind]
+        if self.client:
+            return self.client.create(kind, cls, kwargs)
+        return cls(**kwargs)
+
+    def setCamera(self, position=None, lookAt=None, nearClipDistance=None, fovy=None):
+        """Place and aim the camera; fovy is the vertical field of view in degrees."""
+        if self.client:
+            self.client.control(('camera', dict(position=position, lookAt=lookAt, nearClipDistance=nearClipDistance, fovy=fovy)))
+            return
+        camera = self.app.camera
+        if position is not None:
+            camera.setPosition(ogre.Vector3(*position))
+        if lookAt is not None:
+            camera.lookAt(ogre.Vector3(*lookAt))
+        if nearClipDistance is not None:
+            camera.setNearClipDistance(nearClipDistance)
+        if fovy is not None:
+            camera.setFOVy(ogre.Degree(fovy))
+
     def SetDefaultFont(self, name = None, size = None):
         return SetDefaultFont(name=name, size=size)
 
@@ -168,12 +367,16 @@ class OgreRenderer(BciGenericRenderer):
     def get_size(self): return self.size
     @property
     def width(self):
+        if self.client:
+            return self._size[0]
         if self.app.hmd:
             return 2*self.app.viewPorts[0].getActualWidth()
         else:
             return self.app.viewPort.getActualWidth()
     @property
     def height(self):
+        if self.client:
+            return self._size[1]
         if self.app.hmd:
             return self.app.viewPorts[0].getActualHeight()
         else:
@@ -184,6 +387,9 @@ class OgreRenderer(BciGenericRenderer):
             return self._bgcolor
         def fset(self, value):
             self._bgcolor = value
+            if self.client:
+                self.client.control(('screen', 'bgcolor', value))
+                return
             if self.app.hmd:
                 for vp in self.app.viewPorts:
                     vp.setBackgroundColour(self._bgcolor)
@@ -197,6 +403,10 @@ class OgreRenderer(BciGenericRenderer):
         def fget(self):
             return self._coordinate_mapping
         def fset(self, value):
+            if self.client:
+                self._coordinate_mapping = value
+                self.client.control(('screen', 'coordinate_mapping', value))
+                return
             #zpos = self.app.camera.getPosition()[2]
             zpos = 0.0
             cm = value.lower().replace('bottom', 'lower').replace('top', 'upper').replace(' ', '')
@@ -408,9 +618,9 @@ class OgreStimulus(Coords.Box):
             self.reset()
         return property(fget, fset)
 
-class EntityStimulusAnimFrameListener(ogre.FrameListener):
+class EntityStimulusAnimFrameListener(object): #Combined with the backend's FrameListener by ogre.listener
     def __init__(self, entity):
-        ogre.FrameListener.__init__(self)
+        super(EntityStimulusAnimFrameListener, self).__init__() #Reaches the FrameListener of the backend
         self.entity = entity
         self.animStates = self.entity.getAllAnimationStates()
         animIt = self.animStates.getAnimationStateIterator()
@@ -426,9 +636,9 @@ class EntityStimulusAnimFrameListener(ogre.FrameListener):
                 animState.addTime(evt.timeSinceLastFrame)
         return True
 
-class EntityStimulusMoveFrameListener(ogre.FrameListener):
+class EntityStimulusMoveFrameListener(object):
     def __init__(self, entitystim):
-        ogre.FrameListener.__init__(self)
+        super(EntityStimulusMoveFrameListener, self).__init__()
         self.entitystim = entitystim
 
     def frameRenderingQueued ( self, evt ):
@@ -469,13 +679,13 @@ class EntityStimulus():
         #orig_size = self.entity.getBoundingBox().getSize()
         #self.__original_size = Coords.Size((orig_size[0],orig_size[1],orig_size[2]))
         self.move() #Initialize some variables.
-        self.moveFrameListener = EntityStimulusMoveFrameListener(self)
+        self.moveFrameListener = ogre.listener(EntityStimulusMoveFrameListener, self)
         ogr.addFrameListener(self.moveFrameListener)
 
         #Add a new frame listener to ogr for this stimulus' animations.
         if self.entity.getAllAnimationStates():
             self.entity.pause = {}
-            self.animFrameListener = EntityStimulusAnimFrameListener(self.entity)
+            self.animFrameListener = ogre.listener(EntityStimulusAnimFrameListener, self.entity)
             ogr.addFrameListener(self.animFrameListener)
         #Common settings
         #OgreStimulus.__init__(self, **kwargs)
@@ -641,124 +851,278 @@ class HandStimulus(EntityStimulus):
     def getPose(self):
         return self.__pose_ix
 
-class TailStimulusRotateFrameListener(ogre.FrameListener):
+def quatToArray(q):
+    """(w, x, y, z) array of an ogre.Quaternion, for QuaternionMath."""
+    return numpy.array([q.w, q.x, q.y, q.z])
+
+class TailStimulusRotateFrameListener(object):
     def __init__(self, entity):
-        ogre.FrameListener.__init__(self)
+        super(TailStimulusRotateFrameListener, self).__init__()
         self.tail = entity
         self.tail.isRotating = False
         self.interpVal = 0.0
+        self.interpQuat0, self.interpQuat = QuaternionMath.identity(), QuaternionMath.identity()
+        #Bone handles are resolved once; the last written orientations let us skip unchanged bones.
+        self.bones = self.tail.bones
+        self.lastQuats = numpy.empty((len(self.bones), 4))
+        self.lastQuats.fill(numpy.nan)
+
+    def frameStarted(self, evt):
+        #Apply the latest target published by setTarget; bones are only touched in this thread.
+        target = self.tail.poseChannel.take()
+        if target is not None:
+            vx, vy, duration, stamp, t, default = target
+            self.tail.inverseKinematics(True, bool(default), vx, vy, duration, stamp, t)
+        return True
+
+    def writePose(self, quat0, quat):
+        """Set bone 0 to quat0 and every following bone to quat (w, x, y, z arrays),
+        touching only the bones whose orientation differs from the last write."""
+        last = self.lastQuats
+        if not (last[0] == quat0).all():
+            self.bones[0].setOrientation(ogre.Quaternion(*quat0))
+            last[0] = quat0
+        changed = numpy.flatnonzero((last[1:] != quat).any(axis=1)) + 1
+        if len(changed):
+            q = ogre.Quaternion(*quat)
+            for key in changed:
+                self.bones[key].setOrientation(q)
+            last[changed] = quat
+
+    def writeChain(self, quats):
+        """Set each bone to its row of quats, skipping unchanged bones."""
+        last = self.lastQuats[:len(quats)]
+        for key in numpy.flatnonzero((last != quats).any(axis=1)):
+            self.bones[key].setOrientation(ogre.Quaternion(*quats[key]))
+        last[...] = quats
 
     def frameRenderingQueued ( self, evt ):
-        if self.tail.isRotating:
+        if self.tail.isRotating and self.tail.follower and self.tail.willQuats is None:
+            angles = self.tail.follower.update(evt.timeSinceLastFrame)
+            if self.tail.follower.settled():
+                self.tail.follower.reset(self.tail.follower.target)
+                self.tail.isRotating = False
+            QuaternionMath.fromAngleZ(angles[0], out=self.interpQuat0)
+            QuaternionMath.fromAngleZ(angles[1], out=self.interpQuat)
+            self.writePose(self.interpQuat0, self.interpQuat)
+        elif self.tail.isRotating:
             self.interpVal += evt.timeSinceLastFrame
-            interpQuat0 = ogre.Quaternion.Slerp(numpy.clip(self.interpVal / self.tail.duration, 0.0, 1.0), self.tail.isQuat0, self.tail.willQuat0, False)
-            interpQuat = ogre.Quaternion.Slerp(numpy.clip(self.interpVal / self.tail.duration , 0.0, 1.0), self.tail.isQuat, self.tail.willQuat, False)
-            stopRotating = False
-            if self.interpVal / self.tail.duration > 1.0:
+            t = self.interpVal / self.tail.duration
+            if t > 1.0:
                 self.tail.isRotating = False
                 self.interpVal = 0.0
+            elif self.tail.willQuats is not None:
+                self.writeChain(QuaternionMath.slerp(t, self.tail.isQuats, self.tail.willQuats, True))
             else:
-                for key in range(self.tail.entity.skeleton.numBones-1):
-                    bone = self.tail.entity.skeleton.getBone(key)
-                    if key == 0:
-                        bone.setOrientation(interpQuat0)
-                    else:
-                        bone.setOrientation(interpQuat)
+                QuaternionMath.slerp(t, self.tail.isQuat0, self.tail.willQuat0, False, out=self.interpQuat0)
+                QuaternionMath.slerp(t, self.tail.isQuat, self.tail.willQuat, False, out=self.interpQuat)
+                self.writePose(self.interpQuat0, self.interpQuat)
+        if self.tail.latency:
+            self.tail.latency.frameApplied()
         return True
 
 class TailStimulus(EntityStimulus):
-    def __init__(self, mesh_name='NormalTail.mesh', **kwargs):
+    restPose = (-8.0, 18.0) # target of inverseKinematics(default=True)
+
+    def __init__(self, mesh_name='NormalTail.mesh', ikCacheSize=256, ikCacheStep=0.01, targetEpsilon=1e-4,
+                 follow='slerp', timeConstant=0.08, predictionHorizon=0.0, **kwargs):
+        """follow='slerp' moves to each new IK target with a slerp lasting the
+        duration given to inverseKinematics. follow='spring' instead tracks
+        the latest target with a critically damped spring on the bone angles
+        (time constant timeConstant seconds), which is smooth at any packet rate.
+        A positive predictionHorizon (seconds) extrapolates IK targets that far
+        ahead with SignalPipeline.AlphaBetaPredictor to hide pipeline latency.
+        ikCacheSize targets (snapped to ikCacheStep) outside the IK table keep
+        their solutions; targets inside it are interpolated afresh every time.
+        """
         EntityStimulus.__init__(self, mesh_name='NormalTail.mesh', **kwargs)
         ogr = ogre.Root.getSingleton()
+        skel = self.entity.skeleton
+        self.bones = [skel.getBone(key) for key in range(skel.numBones-1)] # the last bone is never rotated
 
         # FrameListener
-        self.rotateFrameListener = TailStimulusRotateFrameListener(self)
+        self.rotateFrameListener = ogre.listener(TailStimulusRotateFrameListener, self)
         ogr.addFrameListener(self.rotateFrameListener)
 
         # Inverse Kinematics
+        self.ikSolver = TailKinematics.ArcSolver(len(self.bones), self.bones[1].position.y)
+        self.ikTable = None # see useIKTable
+        self.ikCache = TailKinematics.QuantizedLRUCache(ikCacheSize, ikCacheStep) if ikCacheSize > 0 else None
+        self.chainSolver = None # see useChainIK
+        self.isQuats, self.willQuats = None, None # per bone targets of inverseKinematicsChain
+        self.targetEpsilon = targetEpsilon # targets closer than this to lastTarget, with lastDuration, are ignored
+        self.lastTarget = None
+        self.lastDuration = None
+        self.lastPrediction = None #Predicted target lastTarget was solved for
+        self.willAngles = (0.0, 0.0)
+        self.willTime = float('nan') # packet time of the target willAngles were solved for
+        self.follower = TailKinematics.CriticallyDampedFollower(self.willAngles, timeConstant) if follow == 'spring' else None
+        self.predictor = SignalPipeline.AlphaBetaPredictor(predictionHorizon) if predictionHorizon > 0.0 else None
         self.duration = 0.0
-        self.inverseKinematics(False, True, -8.0, 18.0, 0.0)
-        self.isQuat0, self.isQuat = ogre.Quaternion(), ogre.Quaternion()
-        self.willQuat0, self.willQuat = ogre.Quaternion(), ogre.Quaternion()
-        for key in range(self.entity.skeleton.numBones):
-            bone=self.entity.skeleton.getBone(key)
+        self.latency = None # a Latency.LatencyTracker to time targets to the bones
+        self.poseChannel = PoseChannel.PoseChannel() # targets from setTarget, applied at frame start
+        self.inverseKinematics(False, True, duration=0.0)
+        self.isQuat0, self.isQuat = QuaternionMath.identity(), QuaternionMath.identity()
+        self.willQuat0, self.willQuat = QuaternionMath.identity(), QuaternionMath.identity()
+        for key in range(skel.numBones):
+            bone=skel.getBone(key)
             bone.manuallyControlled=True
 
-    def inverseKinematics(self, IK = False, default = False, vx = None, vy = None, duration = 1.0): # vx, vy are target Vector
-        # current angle to Quaternion, animation time
-        self.isQuat0 = self.entity.skeleton.getBone(0).getOrientation()
-        self.isQuat = self.entity.skeleton.getBone(1).getOrientation()
+    def useIKTable(self, xpos, ypos, path=None, resolution=0.25):
+        """Solve targets inside xpos x ypos by interpolating a precomputed table
+        instead of running the Newton solver on every call. The table is loaded
+        from path if it matches this skeleton, otherwise built (and saved to path).
+        Targets outside the table are still solved exactly.
+        """
+        N, d = len(self.bones), self.bones[1].position.y
+        self.ikTable = TailKinematics.loadOrBuildIKTable(N, d, xpos, ypos, path, resolution)
+        return self.ikTable.maxError
+
+    def inverseKinematicsBatch(self, vx, vy, quaternions=False):
+        """Solve arrays of targets for this skeleton in one call, without
+        touching the bones. Returns arrays (angle0, angle), or with
+        quaternions=True the matching (..., 4) arrays of (w, x, y, z)
+        for bone 0 and for every following bone.
+        """
+        N, d = len(self.bones), self.bones[1].position.y
+        angle0, angle = TailKinematics.solveArcBatch(N, d, vx, vy)
+        if quaternions:
+            return QuaternionMath.fromAngleZ(angle0), QuaternionMath.fromAngleZ(angle)
+        return angle0, angle
+
+    def useChainIK(self, skeleton_path=None, maxBend=None, **kwargs):
+        """Prepare inverseKinematicsChain. Bone offsets (and so the bone lengths)
+        come from the loaded skeleton, or from a .skeleton file if a path is given.
+        maxBend and kwargs are passed to TailKinematics.FabrikSolver.
+        """
+        skel = self.entity.skeleton
+        n = len(self.bones)
+        if skeleton_path:
+            offsets = TailKinematics.readSkeleton(skeleton_path)[2][1:n+1]
+        else:
+            positions = [skel.getBone(key).position for key in range(1, n+1)]
+            offsets = [(p.x, p.y, p.z) for p in positions]
+        self.chainSolver = TailKinematics.FabrikSolver(offsets, maxBend, **kwargs)
+
+    def inverseKinematicsChain(self, target, duration = 1.0):
+        """Bend the tail so its tip reaches the 3D target (x, y, z) using the
+        general chain solver (see useChainIK), which allows tapered bones and
+        joint limits. Every bone gets its own orientation, animated over duration.
+        """
+        if not self.chainSolver:
+            self.useChainIK()
+        self.willQuats = self.chainSolver.solve(target)
+        self.lastTarget = None
         self.duration = duration
+        if duration > 0.0:
+            self.isQuats = numpy.array([quatToArray(self.bones[key].getOrientation()) for key in range(len(self.willQuats))])
+            self.rotateFrameListener.interpVal = 0.0
+            self.isRotating = True
+        else:
+            self.rotateFrameListener.writeChain(self.willQuats)
+            self.isRotating = False
+
+    def setTarget(self, vx, vy, duration = 1.0, default = False, t = None, stamp = None):
+        """Have the render thread bend the tail towards (vx, vy) over duration
+        seconds, as inverseKinematics does, at the start of its next frame. Safe to
+        call from the application thread; only the latest target is applied.
+        default=True goes to the rest pose, and t is the packet time and stamp the
+        packet's arrival, as in inverseKinematics (default: the latency tracker's
+        latest packet)."""
+        if stamp is None and self.latency:
+            stamp = self.latency.packetTime
+        now = Latency.monotonic()
+        self.poseChannel.publish(vx, vy, duration, now if stamp is None else stamp, now if t is None else t, default)
+
+    def resetStats(self):
+        """Clear the prediction error statistics, e.g. at the start of a run."""
+        if self.predictor:
+            self.predictor.resetStats()
+
+    def inverseKinematics(self, IK = False, default = False, vx = None, vy = None, duration = 1.0, stamp = None, t = None): # vx, vy are target Vector
+        """Bend the tail towards (vx, vy) over duration seconds. This touches the
+        bones, so outside the render thread use setTarget instead. stamp is the
+        monotonic time of the packet the target was computed for (default: the
+        latest packet). t is the packet time in seconds (samples so far over the
+        sampling rate) the predictor is clocked by (default: the monotonic clock).
+        Returns False, doing nothing, if the target is within targetEpsilon of the
+        previous target and has the same duration, so repeated targets do not
+        restart the rotation. The comparison is on the targets as given, before
+        prediction; with a predictor the prediction must not have moved either,
+        and the predictor still sees the repeated target."""
         if default:
-            vx, vy = -8.0, 18.0
+            vx, vy = self.restPose
+        target = (vx, vy)
+        repeated = IK and self.lastTarget is not None and duration == self.lastDuration \
+            and abs(vx - self.lastTarget[0]) <= self.targetEpsilon and abs(vy - self.lastTarget[1]) <= self.targetEpsilon
+        if repeated and not self.predictor:
+            return False
+        if self.predictor:
+            if IK and not default:
+                vx, vy = self.predictor.update(target, Latency.monotonic() if t is None else t)
+                if repeated and abs(vx - self.lastPrediction[0]) <= self.targetEpsilon \
+                        and abs(vy - self.lastPrediction[1]) <= self.targetEpsilon:
+                    return False
+            else:
+                self.predictor.reset()
+                if repeated:
+                    return False
+
+        # current angle to Quaternion, animation time
+        self.isQuat0 = quatToArray(self.bones[0].getOrientation())
+        self.isQuat = quatToArray(self.bones[1].getOrientation())
+        self.duration = duration
+        self.willQuats = None
 
         if not IK:
             self.willQuat0, self.willQuat = self.isQuat0, self.isQuat
             self.isRotating = False
+            self.lastTarget = None
         else:
-            # number of bones, bone length, tail length, target vector, target distance
-            N = self.entity.skeleton.numBones - 1
-            d = self.entity.skeleton.getBone(1).position.y
-            L = N * d
-            vx, vy = vx * 1.0, vy * 1.0
-            D = math.sqrt ( vx*vx + vy*vy )
-
-            # theta calculation
-            theta = 2*math.pi/N # default
-            for i in range(5):
-                func = d * math.sin( N*theta/2.0 ) - D * math.sin( theta/2.0 )
-                derivative = d*N/2.0 * math.cos( N*theta/2.0 ) - D/2.0 * math.cos( theta/2.0 )
-                theta = theta - func/derivative
-
-            # radius, perpendicularity, Centre
-            R = d / 2.0 / math.sin( theta/2.0 )
-            S = R * math.cos( N*theta/2.0 )
-            Cxp, Cyp = vx/2.0 - vy*S/D, vy/2.0 + vx*S/D
-            Cxn, Cyn = vx/2.0 + vy*S/D, vy/2.0 - vx*S/D
-
-            # target angle for each bone
-            isAnglep, isAnglen = theta, -theta
-
-            if Cxp < 0.0:
-                isAngle0p = theta/2.0 + math.atan(Cyp/Cxp)
-            else:
-                isAngle0p = theta/2.0 + math.atan(Cyp/Cxp) - math.pi 
-
-            if Cxn < 0.0:
-                isAngle0n = -theta/2.0 + math.atan(Cyn/Cxn) - math.pi
+            self.lastTarget, self.lastDuration, self.lastPrediction = target, duration, (vx, vy)
+            self.willTime = float('nan') if t is None else t
+            # the final quaternions of a recently seen target, if cached; targets the
+            # IK table covers skip the cache, whose snapping would add to the table's error
+            inTable = self.ikTable is not None and self.ikTable.covers(vx, vy)
+            cached = self.ikCache.get(vx, vy) if self.ikCache and not inTable else None
+            if cached:
+                self.willAngles, self.willQuat0, self.willQuat = cached
             else:
-                isAngle0n = -theta/2.0 + math.atan(Cyn/Cxn)
-
-            if vx < 0.0:
-                isAngle0 = isAngle0p
-                isAngle = isAnglep
-            else:
-                isAngle0 = isAngle0n
-                isAngle = isAnglen
-
-            # Euler to Quaternion
-            M0, M = ogre.Matrix3(), ogre.Matrix3()
-            M0.FromEulerAnglesXYZ(0.0, 0.0, isAngle0)
-            M.FromEulerAnglesXYZ(0.0, 0.0, isAngle)
-            #if default:
-            #    M0.FromEulerAnglesXYZ(0.0, 0.0, 0.0)
-            #    M.FromEulerAnglesXYZ(0.0, 0.0, 0.0)
-            self.willQuat0, self.willQuat = ogre.Quaternion(M0), ogre.Quaternion(M)
+                # target angle for bone 0 and for each following bone
+                if inTable:
+                    isAngle0, isAngle = self.ikTable.lookup(vx, vy)
+                else:
+                    isAngle0, isAngle = self.ikSolver.solve(vx, vy)
+                    if self.ikSolver.clamped:
+                        RingLog.getLogger().write("TailStimulus: IK target (%g, %g) is out of reach, clamped to the workspace", vx, vy)
+                    if not self.ikSolver.converged:
+                        RingLog.getLogger().write("TailStimulus: IK did not converge for (%g, %g), residual %g after %d iterations",
+                                                  vx, vy, self.ikSolver.residual, self.ikSolver.iterations)
+
+                # Euler to Quaternion
+                self.willAngles = (isAngle0, isAngle)
+                self.willQuat0, self.willQuat = QuaternionMath.fromAngleZ(isAngle0), QuaternionMath.fromAngleZ(isAngle)
+                if self.ikCache and not inTable:
+                    self.ikCache.put(vx, vy, (self.willAngles, self.willQuat0, self.willQuat))
+
+            if self.latency:
+                self.latency.ikSolved(stamp)
 
             # For FlameListener
             if self.duration > 0.0:
+                if self.follower:
+                    self.follower.target[...] = self.willAngles
+                else:
+                    self.rotateFrameListener.interpVal = 0.0 # a new target starts a new slerp
                 self.isRotating = True
             else:
-                M0.FromEulerAnglesXYZ(0.0, 0.0, isAngle0)
-                M.FromEulerAnglesXYZ(0.0, 0.0, isAngle)
-                self.willQuat0, self.willQuat = ogre.Quaternion(M0), ogre.Quaternion(M)
-                for key in range(N):
-                    bone = self.entity.skeleton.getBone( key )
-                    if key == 0:
-                        bone.setOrientation(self.willQuat0)
-                    else:
-                        bone.setOrientation(self.willQuat)
+                if self.follower:
+                    self.follower.reset(self.willAngles)
+                self.rotateFrameListener.writePose(self.willQuat0, self.willQuat)
                 self.isRotating = False
+                if self.latency:
+                    self.latency.frameApplied()
+        return True
 
 class PrefabStimulus(EntityStimulus):
     def __init__(self, pttype="sphere", **kwargs):
@@ -0,0 +1,86 @@
+"""Declarative phase machine for BCPy2000 applications.
+
+Each row of the table names a phase, the phase that follows it and its
+duration (ms), the BCI2000 states it sets and the stimulus properties it
+shows. The table is compiled once. Every phase gets a full vector of
+(target, value) writes, and enter() writes only the entries that differ from
+what was last written, using a diff cached per transition.
+
+    table = PhaseTable([
+        dict(name='gocue', next='task', duration=1000, states={'GoCue': 1},
+             stimuli={'cue': {'text': 'Go', 'on': True}}),
+        dict(name='task', next='gocue', duration=6000, states={'Task': 1}),
+        ], states=['GoCue', 'Task'], stimuli={'cue': {'on': False}})
+
+A state listed in states is 0 in every phase that does not set it, and a
+stimulus property in stimuli takes that default value. Any other property is
+left as it is in phases that do not set it. A phase without a row (such as a
+new_trial phase the framework enters between trials) gets these defaults. A
+row may name a branch phase that the application jumps to on an event (see
+branch()).
+"""
+
+class PhaseTable(object):
+    def __init__(self, rows, states=(), stimuli=None):
+        self.rows = [dict(row) for row in rows]
+        self.byName = dict((row['name'], row) for row in self.rows)
+        self.start = self.rows[0]['name']
+        stimuli = stimuli or {}
+        self.default = dict((('state', name), 0) for name in states)
+        for stim, props in stimuli.items():
+            self.default.update((('stimulus', stim, attr), value) for attr, value in props.items())
+        self.vectors = {}
+        for row in self.rows:
+            vector = dict(self.default)
+            vector.update((('state', name), value) for name, value in row.get('states', {}).items())
+            for stim, props in row.get('stimuli', {}).items():
+                vector.update((('stimulus', stim, attr), value) for attr, value in props.items())
+            self.vectors[row['name']] = vector
+        self.diffs = {}
+        for row in self.rows: #Declared transitions are diffed up front, others on first use
+            for next in (row['next'], row.get('branch')):
+                if next:
+                    self.diff(row['name'], next)
+        self.reset()
+
+    def reset(self):
+        """Forget what was written, so the next enter() writes every entry."""
+        self.current, self.written = None, {}
+
+    def diff(self, prev, next):
+        """(target, value) writes turning phase prev's vector into next's."""
+        key = (prev, next)
+        if key not in self.diffs:
+            old, new = self.vectors.get(prev, self.default), self.vectors.get(next, self.default)
+            self.diffs[key] = [(target, value) for target, value in sorted(new.items())
+                               if target not in old or old[target] != value]
+        return self.diffs[key]
+
+    def define(self, app, **kwargs):
+        """Declare the table to a BCPy2000 application's phase machine; kwargs
+        go to app.design along with the first row as start."""
+        for row in self.rows:
+            app.phase(name=row['name'], next=row['next'], duration=row.get('duration'))
+        app.design(start=self.start, **kwargs)
+
+    def branch(self, phase):
+        """Phase to jump to from phase on an application event, or None."""
+        return self.byName[phase].get('branch') if phase in self.byName else None
+
+    def enter(self, phase, app):
+        """Write the states and stimulus properties that change on entering phase;
+        a phase without a row goes back to the defaults."""
+        if self.current is None:
+            writes = sorted(self.vectors.get(phase, self.default).items())
+        else:
+            writes = self.diff(self.current, phase)
+        written = self.written
+        for target, value in writes:
+            if written.get(target, written) == value: #Already showing, e.g. after an unplanned jump
+                continue
+            if target[0] == 'state':
+                app.states[target[1]] = value
+            else:
+                setattr(app.stimuli[target[1]], target[2], value)
+            written[target] = value
+        self.current = phase
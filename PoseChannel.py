@@ -0,0 +1,48 @@
+"""Latest-value channel handing tail targets from the application thread to
+the render thread without a lock.
+
+The writer fills the back slot of a two-slot buffer and then publishes it by
+advancing a sequence number, so a reader never sees a half-written target.
+If a second publish lands in the slot a reader is copying, the reader notices
+that the sequence moved and copies again. Targets published between two
+reads are superseded: take() returns only the latest, once.
+
+    channel = PoseChannel()
+    channel.publish(vx, vy, duration, stamp, t) # BCPy2000 thread, per packet
+    target = channel.take()                     # render thread, per frame
+    if target is not None:
+        vx, vy, duration, stamp, t, default = target
+"""
+import numpy
+
+class PoseChannel(object):
+    fields = ('vx', 'vy', 'duration', 'stamp', 'time', 'default')
+
+    def __init__(self):
+        self.slots = numpy.zeros((2, len(self.fields)))
+        self.seq = 0 #Number of targets published; the latest is in slots[seq & 1]
+        self.taken = 0 #seq of the last target returned by take()
+        self.superseded = 0 #Targets replaced before the render thread took them
+
+    def publish(self, vx, vy, duration, stamp, t, default=False):
+        """Make (vx, vy, duration, stamp, t, default) the latest target: stamp is the
+        packet's arrival (Latency.monotonic), t its packet time, and default marks
+        the rest pose rather than a tracked target. Writer thread only."""
+        seq = self.seq + 1
+        self.slots[seq & 1] = (vx, vy, duration, stamp, t, default)
+        self.seq = seq #Publish only once the slot is complete
+
+    def take(self):
+        """The latest target as a tuple (default as a float), or None if none was
+        published since the last call. Reader thread only."""
+        while True:
+            seq = self.seq
+            if seq == self.taken:
+                return None
+            target = tuple(self.slots[seq & 1])
+            if self.seq == seq: #Otherwise the writer may have refilled this slot meanwhile
+                break
+        self.superseded += seq - self.taken - 1
+        self.taken = seq
+        return target
+
@@ -0,0 +1,132 @@
+"""Quaternion and rotation math on NumPy arrays, without Ogre.
+
+Quaternions are stored as (w, x, y, z) along the last axis, the component order
+ogre.Quaternion takes, so a result converts with ogre.Quaternion(*q) at the point
+it is handed to Ogre. Every function broadcasts over leading axes, so one call
+handles a single rotation or a whole skeleton, and takes an optional out array
+so per-frame code can reuse preallocated buffers.
+"""
+import numpy
+
+def identity(shape=()):
+    """Identity rotation(s), e.g. identity() or identity(30) for a whole chain."""
+    shape = (shape,) if isinstance(shape, int) else tuple(shape)
+    q = numpy.zeros(shape + (4,))
+    q[...,0] = 1.0
+    return q
+
+def _out(out, shape):
+    return numpy.empty(shape) if out is None else out
+
+def fromEulerXYZ(x, y, z, out=None):
+    """Quaternion of the rotation ogre.Matrix3.FromEulerAnglesXYZ(x, y, z) builds,
+    i.e. Rx*Ry*Rz (radians)."""
+    x, y, z = numpy.broadcast_arrays(numpy.asarray(x, dtype=float) / 2.0,
+                                     numpy.asarray(y, dtype=float) / 2.0,
+                                     numpy.asarray(z, dtype=float) / 2.0)
+    cx, sx, cy, sy, cz, sz = numpy.cos(x), numpy.sin(x), numpy.cos(y), numpy.sin(y), numpy.cos(z), numpy.sin(z)
+    q = _out(out, x.shape + (4,))
+    q[...,0] = cx*cy*cz - sx*sy*sz
+    q[...,1] = sx*cy*cz + cx*sy*sz
+    q[...,2] = cx*sy*cz - sx*cy*sz
+    q[...,3] = cx*cy*sz + sx*sy*cz
+    return q
+
+def fromAngleZ(angle, out=None):
+    """Quaternion of a rotation by angle (radians) about Z."""
+    angle = numpy.asarray(angle, dtype=float)
+    q = _out(out, angle.shape + (4,))
+    q[...,0] = numpy.cos(angle/2.0)
+    q[...,1] = 0.0
+    q[...,2] = 0.0
+    q[...,3] = numpy.sin(angle/2.0)
+    return q
+
+def multiply(a, b, out=None):
+    """Hamilton product a*b: the rotation b followed by a."""
+    a, b = numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float)
+    aw, ax, ay, az = a[...,0], a[...,1], a[...,2], a[...,3]
+    bw, bx, by, bz = b[...,0], b[...,1], b[...,2], b[...,3]
+    q = _out(out, numpy.broadcast(aw, bw).shape + (4,))
+    w = aw*bw - ax*bx - ay*by - az*bz
+    x = aw*bx + ax*bw + ay*bz - az*by
+    y = aw*by - ax*bz + ay*bw + az*bx
+    z = aw*bz + ax*by - ay*bx + az*bw
+    q[...,0], q[...,1], q[...,2], q[...,3] = w, x, y, z #Assigned last so out may alias a or b
+    return q
+
+def conjugate(q, out=None):
+    """Inverse of a unit quaternion."""
+    q = numpy.asarray(q, dtype=float)
+    r = _out(out, q.shape)
+    r[...,0] = q[...,0]
+    r[...,1:] = -q[...,1:]
+    return r
+
+def normalize(q, out=None):
+    q = numpy.asarray(q, dtype=float)
+    return numpy.divide(q, numpy.sqrt((q*q).sum(axis=-1))[...,None], out=out)
+
+def rotate(q, v, out=None):
+    """Rotate vectors v (..., 3) by unit quaternions q (..., 4)."""
+    q, v = numpy.asarray(q, dtype=float), numpy.asarray(v, dtype=float)
+    u = q[...,1:]
+    t = 2.0 * numpy.cross(u, v)
+    r = v + q[...,0,None]*t + numpy.cross(u, t)
+    if out is None:
+        return r
+    out[...] = r
+    return out
+
+def fromTo(a, b, out=None):
+    """Shortest-arc unit quaternion turning unit vectors a onto unit vectors b."""
+    a, b = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float))
+    c = (a*b).sum(axis=-1)
+    q = _out(out, a.shape[:-1] + (4,))
+    q[...,0] = 1.0 + c
+    q[...,1:] = numpy.cross(a, b)
+    opposite = c < -1.0 + 1e-12
+    if opposite.any(): #Turn by pi about any axis perpendicular to a
+        ao = a[opposite]
+        axis = numpy.cross(ao, (1.0, 0.0, 0.0))
+        small = (axis*axis).sum(axis=-1) < 1e-12
+        axis[small] = numpy.cross(ao[small], (0.0, 1.0, 0.0))
+        q[opposite,0] = 0.0
+        q[opposite,1:] = axis
+    return normalize(q, out=q)
+
+def dot(a, b):
+    return (numpy.asarray(a) * numpy.asarray(b)).sum(axis=-1)
+
+def nlerp(t, a, b, shortestPath=False, out=None):
+    """Normalised linear interpolation from a (t=0) to b (t=1)."""
+    a, b = numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float)
+    t = numpy.asarray(t, dtype=float)[...,None]
+    if shortestPath:
+        b = numpy.where((dot(a, b) < 0.0)[...,None], -b, b)
+    q = a + t*(b - a)
+    return normalize(q, out=out)
+
+def slerp(t, a, b, shortestPath=False, out=None):
+    """Spherical linear interpolation from a (t=0) to b (t=1), the same as
+    ogre.Quaternion.Slerp(t, a, b, shortestPath): nearly parallel pairs fall
+    back to nlerp."""
+    a, b = numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float)
+    t = numpy.asarray(t, dtype=float)[...,None]
+    c = dot(a, b)
+    if shortestPath:
+        flip = c < 0.0
+        b = numpy.where(flip[...,None], -b, b)
+        c = numpy.where(flip, -c, c)
+    c = numpy.asarray(c)[...,None]
+    linear = numpy.abs(c) >= 1.0 - 1e-3
+    angle = numpy.arccos(numpy.clip(c, -1.0, 1.0))
+    s = numpy.sin(angle)
+    s = numpy.where(linear, 1.0, s)
+    ka = numpy.where(linear, 1.0 - t, numpy.sin((1.0 - t)*angle) / s)
+    kb = numpy.where(linear, t, numpy.sin(t*angle) / s)
+    q = numpy.multiply(ka, a, out=out)
+    q += kb*b
+    if linear.any():
+        normalize(q, out=q)
+    return q
@@ -0,0 +1,252 @@
+"""Ogre rendering in a process of its own.
+
+With OgreRenderer.setup(process=True) the renderer spawns a render process
+instead of a render thread. Python frame listeners then no longer share a
+GIL with signal processing, and each side can use a full core. The
+application process keeps RemoteStimulus handles, and everything it does to
+them travels through a SharedRing in shared memory. The render process drains
+the ring once per frame, between frames (OgreRenderer.frameHook):
+
+    TARGET   tail target (vx, vy, duration, stamp, t, default); only the latest
+             per frame is handed on, to TailStimulus.setTarget
+    SET      numeric (bool, int or float) stimulus property
+    CONTROL  the next item of a pickled side queue: stimulus creation, method
+             calls, camera and screen settings, deferred resource groups and
+             non-numeric properties
+    STOP     leave the render loop
+
+Records carry sequence numbers, and CONTROL records keep the side queue in
+ring order. Only the application thread may write the ring. Ring and queue
+are created before the process starts, so this also works where processes
+are spawned rather than forked (Windows).
+"""
+import time
+import multiprocessing
+import numpy
+from Latency import monotonic
+
+TARGET, SET, CONTROL, STOP = 1, 2, 3, 4
+
+class SharedRing(object):
+    """Single-writer, single-reader ring of fixed-size float64 records
+    [seq, op, id, a0, ..., a5] in shared memory. A slot holds record seq once
+    its first field reads seq, which the writer stores last."""
+    width = 9
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.raw = multiprocessing.RawArray('d', capacity*self.width)
+        self.consumed = multiprocessing.RawValue('d', 0.0) #Last seq the reader has finished with
+        self.attach()
+        self.records[:,0] = -1
+        self.seq = 0 #Writer side: last seq written
+        self.next = 1 #Reader side: seq expected next
+        self.dropped = 0 #Targets dropped by the writer because the ring was full
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['records']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def attach(self):
+        self.records = numpy.ctypeslib.as_array(self.raw).reshape(self.capacity, self.width)
+
+    def full(self):
+        return self.seq - self.consumed.value >= self.capacity
+
+    def write(self, op, id=0, *args):
+        """Append a record. A full ring drops targets (a later one supersedes them)
+        and waits for the reader for everything else. False if dropped."""
+        while self.full():
+            if op == TARGET:
+                self.dropped += 1
+                return False
+            time.sleep(0.001)
+        seq = self.seq + 1
+        record = self.records[seq % self.capacity]
+        record[1:3] = op, id
+        record[3:3+len(args)] = args
+        record[0] = seq #Publish
+        self.seq = seq
+        return True
+
+    def read(self):
+        """The records written since the last call, oldest first."""
+        records = []
+        while True:
+            record = self.records[self.next % self.capacity]
+            if record[0] != self.next:
+                break
+            records.append(record.copy())
+            self.next += 1
+        if records:
+            self.consumed.value = self.next - 1
+        return records
+
+class RemoteStimulus(object):
+    """Application-side handle of a stimulus living in the render process.
+
+    Setting an attribute sets it in the render process and remembers the value
+    for reading back. Methods of the stimulus class are called in the render
+    process and return None. setTarget goes through the ring as a TARGET.
+    """
+    def __init__(self, client, id, cls):
+        self.__dict__.update(_client=client, _id=id, _cls=cls)
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        self._client.set(self._id, name, value)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(self._cls, name, None)):
+            raise AttributeError(name)
+        def call(*args, **kwargs):
+            self._client.control(('call', self._id, name, args, kwargs))
+        return call
+
+    def setTarget(self, vx, vy, duration=1.0, default=False, t=None, stamp=None):
+        now = monotonic()
+        self._client.ring.write(TARGET, self._id, vx, vy, duration, now if stamp is None else stamp,
+                                now if t is None else t, default)
+
+class RenderClient(object):
+    """The application process's end: starts the render process and writes
+    the ring."""
+    types = (bool, int, float) #Numeric property types, coded in SET records
+    def __init__(self, settings, frameTimes=None, capacity=1024):
+        self.ring = SharedRing(capacity)
+        self.queue = multiprocessing.Queue()
+        self.ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=serve, args=(self.ring, self.queue, self.ready, settings, frameTimes))
+        self.process.daemon = True
+        self.names = {} #Attribute name -> code, as interned in the render process
+        self.count = 0
+
+    def start(self, timeout=60.0):
+        """Start the render process and wait until it is ready to render."""
+        self.process.start()
+        deadline = monotonic() + timeout
+        while not self.ready.is_set():
+            if not self.process.is_alive():
+                raise RuntimeError("The render process exited with code %s before it was ready" % self.process.exitcode)
+            if monotonic() > deadline:
+                self.process.terminate()
+                raise RuntimeError("The render process was not ready after %g s" % timeout)
+            self.ready.wait(0.1)
+
+    def check(self):
+        """Raise if the render process has exited, rather than write to a ring
+        nobody reads."""
+        if not self.process.is_alive():
+            raise RuntimeError("The render process exited with code %s" % self.process.exitcode)
+
+    def control(self, item):
+        self.queue.put(item)
+        self.ring.write(CONTROL)
+
+    def create(self, kind, cls, kwargs):
+        """Create a stimulus of OgreRenderer class kind in the render process."""
+        self.count += 1
+        self.control(('create', self.count, kind, kwargs))
+        return RemoteStimulus(self, self.count, cls)
+
+    def set(self, id, name, value):
+        if isinstance(value, (bool, int, long, float)):
+            if name not in self.names:
+                self.names[name] = len(self.names)
+                self.control(('name', self.names[name], name))
+            self.ring.write(SET, id, self.names[name], value, self.types.index(type(value)) if type(value) in self.types else 2)
+        else:
+            self.control(('set', id, name, value))
+
+    def stop(self, timeout=5.0):
+        self.ring.write(STOP)
+        self.process.join(timeout)
+
+class RenderServer(object):
+    """The render process's end, run by the render loop between frames."""
+    def __init__(self, renderer, ring, queue, ready):
+        self.renderer, self.ring, self.queue, self.ready = renderer, ring, queue, ready
+        self.stimuli, self.names = {}, {}
+
+    def __call__(self):
+        """Apply everything written since the last frame; False to stop."""
+        if not self.ready.is_set():
+            self.renderer.color = self.renderer._bgcolor
+            self.renderer.coordinate_mapping = self.renderer._coordinate_mapping
+            self.ready.set()
+        targets = {}
+        for seq, op, id, a0, a1, a2, a3, a4, a5 in self.ring.read():
+            if op == TARGET:
+                targets[int(id)] = (a0, a1, a2, a3, a4, bool(a5))
+            elif op == SET:
+                setattr(self.stimuli[int(id)], self.names[int(a0)], RenderClient.types[int(a2)](a1))
+            elif op == CONTROL:
+                self.handle(self.queue.get())
+            elif op == STOP:
+                return False
+        for id, (vx, vy, duration, stamp, t, default) in targets.items():
+            self.stimuli[id].setTarget(vx, vy, duration, default, t, stamp)
+        return True
+
+    def handle(self, item):
+        kind = item[0]
+        if kind == 'create':
+            import OgreRenderer
+            self.stimuli[item[1]] = getattr(OgreRenderer, item[2])(**item[3])
+        elif kind == 'name':
+            self.names[item[1]] = item[2]
+        elif kind == 'set':
+            setattr(self.stimuli[item[1]], item[2], item[3])
+        elif kind == 'call':
+            getattr(self.stimuli[item[1]], item[2])(*item[3], **item[4])
+        elif kind == 'camera':
+            self.renderer.setCamera(**item[1])
+        elif kind == 'screen':
+            setattr(self.renderer, item[1], item[2])
+        elif kind == 'groups' and hasattr(self.renderer.app, 'loadResourceGroups'): #Headless has no resource groups
+            self.renderer.app.loadResourceGroups(item[1])
+
+def serve(ring, queue, ready, settings, frameTimes=None):
+    """Main function of the render process: the render loop of OgreThread, run
+    in this process's main thread, or with settings['headless'] a paced loop of
+    headless frames. Frames are marked in frameTimes, which the application
+    process reads. The log, startup timings included, goes to settings['log_file']
+    if given, else to this process's console."""
+    import Queue
+    import OgreRenderer
+    import RingLog
+    renderer = OgreRenderer.OgreRenderer()
+    renderer.setup(**settings)
+    log = RingLog.getLogger()
+    if renderer.logFile:
+        log.openFile(renderer.logFile)
+    server = RenderServer(renderer, ring, queue, ready)
+    try:
+        if renderer._headless:
+            import FramePacer
+            renderer.Initialize()
+            renderer.frameTimes = frameTimes
+            pacer = FramePacer.FramePacer(renderer.framerate)
+            pacer.start()
+            while server():
+                renderer.FinishFrame() #Marks frameTimes
+                pacer.wait()
+            pacer.stop()
+            renderer.Cleanup()
+            return
+        import OgreApplication
+        renderer.app = OgreApplication.Application()
+        renderer.app.hmd = None
+        if renderer._usehmd:
+            import Rift
+            renderer.app.hmd = Rift.Rift()
+        renderer.frameHook = server
+        renderer.frameTimes = frameTimes
+        OgreRenderer.OgreThread(Queue.Queue(), renderer, renderer.app).run()
+    finally:
+        log.close() #The log thread is a daemon and would die with the process
@@ -0,0 +1,253 @@
+"""Replay a recorded signal through KiPAS without BCI2000, an amplifier or a display.
+
+The application module is executed against a stand-in for the part of
+BCPy2000's BciGenericApplication it uses (parameters, states, the phase
+machine and stimuli), with an OgreRenderer set up headless as its screen
+(see HeadlessOgre; in a render process of its own if the application's
+Preflight asks for one, as KiPAS does with RenderProcess=1), then driven packet
+by packet: Process, then the phase clock, then the frames that fall before the
+next packet. Replays run as fast as possible or, with --realtime, at the pace
+the signal was recorded. Per-packet and per-frame cost is reported at the end,
+along with whether the tail reached its rest pose whenever the application
+showed its default pose (the exit status is 1 if it did not).
+
+    python Replay.py session.npy --rate 1000 --block 20 --param TargetFilter=ema
+
+The signal is fed to the application as its input, so it should be the
+control signal (channels x samples) the application would have received. A
+BCI2000 .dat file is read with BCI2000Tools, which has to be installed.
+BCPy2000 modules that are not installed are replaced by inert stand-ins.
+"""
+import os
+import sys
+import imp
+import time
+import timeit
+import argparse
+import numpy
+
+class Param(str):
+    """A parameter value as the application sees it: a string with .val."""
+    @property
+    def val(self):
+        for kind in (int, float):
+            try:
+                return kind(self)
+            except ValueError:
+                pass
+        return str(self)
+
+class ParamList(list):
+    @property
+    def val(self):
+        return [Param(x).val for x in self]
+
+def parseParam(line):
+    """(name, value) of a BCI2000 parameter definition line."""
+    tokens = line.split('//', 1)[0].split()
+    kind, name, values = tokens[1], tokens[2].rstrip('='), tokens[3:]
+    if kind.endswith('list'):
+        n = int(values[0])
+        return name, ParamList(Param('' if x == '%' else x) for x in values[1:1+n])
+    return name, Param('' if not values or values[0] == '%' else values[0])
+
+class Text(object):
+    """Stand-in for VisualStimuli.Text that only keeps its attributes."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class ReplayApplication(object):
+    """The subset of BciGenericApplication that KiPAS uses.
+
+    Phases() runs once, before the first transition, and declares the
+    application's PhaseTable through phase() and design(). stepPhase() then
+    counts each phase's duration in packet time and moves on to the row's next
+    phase; Transition() writes the table's states for the phase entered. A jump
+    on an application event (PhaseTable.branch, as KiPAS's trigger judgement
+    does) goes through change_phase(next).
+    """
+    genericParams = {'ShowSignalTime': Param('0')}
+    genericStates = ('Running', 'CurrentBlock', 'CurrentTrial', 'PresentationPhase')
+
+    def __init__(self, rate, block, overrides=()):
+        params, states = self.Construct()
+        self.params = dict(self.genericParams)
+        self.params.update(parseParam(p) for p in params)
+        for name, value in overrides:
+            self.params[name] = ParamList(value.split()) if isinstance(self.params.get(name), list) else Param(value)
+        self.states = dict((name, 0) for name in self.genericStates)
+        self.states.update((s.split()[0], 0) for s in states)
+        self.nominal = {'SamplesPerSecond': float(rate), 'SamplesPerPacket': block,
+                        'PacketsPerSecond': float(rate)/block, 'SecondsPerPacket': block/float(rate)}
+        self.estimated = {}
+        import OgreRenderer
+        self.screen = OgreRenderer.OgreRenderer()
+        self.screen.setup(headless=True) #Initialized by replay() after Preflight, which may set .process
+        self.stimuli = {}
+        self.machine, self.start = {}, None
+        self.current, self.elapsed = None, 0.0
+
+    def stimulus(self, name, z=0, stim=None):
+        self.stimuli[name] = stim
+        return stim
+
+    def forget(self, name):
+        pass
+
+    def phase(self, name, next=None, duration=None):
+        self.machine[name] = (next, duration)
+
+    def design(self, start, **kwargs):
+        self.start = start
+
+    def in_phase(self, name):
+        return self.current == name
+
+    def change_phase(self, next=None):
+        if self.start is None:
+            self.Phases()
+        if next is None:
+            next = self.machine[self.current][0] if self.current else self.start
+        self.current, self.elapsed = next, 0.0
+        self.states['PresentationPhase'] = next
+        self.Transition(next)
+
+    def stepPhase(self, ms):
+        """Advance the phase clock by one packet of ms milliseconds."""
+        self.elapsed += ms
+        duration = self.machine.get(self.current, (None, None))[1]
+        if duration is not None and self.elapsed >= duration:
+            self.change_phase()
+
+def installStandIns():
+    """Put inert modules in place of the BCPy2000 ones that are not installed."""
+    def standIn(name, **attrs):
+        try:
+            __import__(name)
+        except ImportError:
+            module = sys.modules[name] = imp.new_module(name)
+            module.__dict__.update(attrs)
+            parent, _, child = name.rpartition('.')
+            if parent:
+                setattr(sys.modules[parent], child, module)
+
+    class Box(object):
+        def __init__(self, *args, **kwargs):
+            pass
+    class BciGenericRenderer(object):
+        pass
+    class BciStimulus(object):
+        pass
+    class Monitor(object):
+        func, pargs = None, ()
+    standIn('SigTools')
+    standIn('AppTools')
+    standIn('AppTools.Boxes', box=Box)
+    standIn('AppTools.Displays', fullscreen=lambda *args, **kwargs: {})
+    standIn('AppTools.StateMonitors', addstatemonitor=lambda *args, **kwargs: Monitor(),
+            addphasemonitor=lambda *args, **kwargs: Monitor())
+    standIn('BCPy2000')
+    standIn('BCPy2000.AppTools')
+    standIn('BCPy2000.AppTools.Coords', Box=Box, Size=tuple, Point=tuple)
+    standIn('BCPy2000.GenericApplication', BciGenericRenderer=BciGenericRenderer, BciStimulus=BciStimulus)
+
+def loadApplication(path, rate, block, overrides=()):
+    """Execute an application module against the stand-ins and instantiate it."""
+    installStandIns()
+    visualStimuli = imp.new_module('VisualStimuli')
+    visualStimuli.Text = Text
+    namespace = {'__name__': 'BciApplicationModule', '__file__': path,
+                 'BciGenericApplication': ReplayApplication, 'VisualStimuli': visualStimuli}
+    execfile(path, namespace)
+    return namespace['BciApplication'](rate, block, overrides)
+
+def loadSignal(path):
+    """(channels x samples array, sample rate or None, block size or None)."""
+    if path.endswith('.dat'):
+        from BCI2000Tools.FileReader import bcistream
+        stream = bcistream(path)
+        sig, states = stream.decode()
+        return numpy.asarray(sig), stream.samplingrate(), int(stream.params['SampleBlockSize'])
+    sig = numpy.load(path)
+    if sig.ndim == 1:
+        sig = sig[None,:]
+    return sig, None, None
+
+def summarize(name, seconds):
+    ms = numpy.array(seconds)*1e3
+    if not len(ms):
+        return "%s: none" % name
+    return "%s: %d, mean %.3f ms, median %.3f ms, 99%% %.3f ms, max %.3f ms" % (
+        name, len(ms), ms.mean(), numpy.median(ms), numpy.percentile(ms, 99), ms.max())
+
+def atRestPose(app):
+    """False if the application shows its default pose (state Default) but its
+    tail's latest target is not the rest pose; True otherwise."""
+    tail = getattr(app, 'feedback', None)
+    if not app.states.get('Default') or not hasattr(tail, 'restPose') or tail.lastTarget is None:
+        return True
+    return numpy.allclose(tail.lastTarget, tail.restPose)
+
+def replay(app, sig, block, realtime=False, fps=60.0):
+    """Feed sig to app packet by packet and return the per-packet and
+    per-frame costs in seconds, and the number of packets after whose frames
+    the default pose was shown with the tail away from its rest pose."""
+    clock = timeit.default_timer
+    app.screen.framerate = fps
+    packetSeconds = app.nominal['SecondsPerPacket']
+    app.Preflight(None)
+    app.screen.Initialize(app) #As BCPy2000 does: after the application's Preflight, before its Initialize
+    app.Initialize(sig.shape[0], 1)
+    app.StartRun()
+    app.states['Running'] = 1
+    app.change_phase()
+    packetCost, frameCost = [], []
+    restMisses = 0
+    frameTime, start = 0.0, clock()
+    for k in range(sig.shape[1] // block):
+        if realtime:
+            delay = start + k*packetSeconds - clock()
+            if delay > 0:
+                time.sleep(delay)
+        t = clock()
+        app.Process(numpy.matrix(sig[:,k*block:(k+1)*block]))
+        app.stepPhase(packetSeconds*1e3)
+        packetCost.append(clock() - t)
+        frames = len(frameCost)
+        while frameTime < (k+1)*packetSeconds:
+            t = clock()
+            app.screen.FinishFrame()
+            frameCost.append(clock() - t)
+            frameTime += 1.0/fps
+        if len(frameCost) > frames and not atRestPose(app): #Only once a frame has taken the packet's target
+            restMisses += 1
+    app.states['Running'] = 0
+    app.StopRun()
+    return packetCost, frameCost, restMisses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded signal through a BCPy2000 application, headless.")
+    parser.add_argument('signal', help=".npy (channels x samples) or BCI2000 .dat file")
+    parser.add_argument('--app', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'KiPAS.py'),
+                        help="application module (default: KiPAS.py)")
+    parser.add_argument('--rate', type=float, help="samples per second (default: from the .dat file, else 1000)")
+    parser.add_argument('--block', type=int, help="samples per packet (default: from the .dat file, else 20)")
+    parser.add_argument('--fps', type=float, default=60.0, help="simulated frame rate (default: 60)")
+    parser.add_argument('--realtime', action='store_true', help="pace packets at the recorded rate")
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help="override an application parameter; may be repeated")
+    args = parser.parse_args(argv)
+
+    sig, rate, block = loadSignal(args.signal)
+    rate, block = args.rate or rate or 1000.0, args.block or block or 20
+    app = loadApplication(args.app, rate, block, [p.split('=', 1) for p in args.param])
+    packetCost, frameCost, restMisses = replay(app, sig, block, args.realtime, args.fps)
+    import RingLog
+    RingLog.getLogger().close()
+    print summarize("packets", packetCost)
+    print summarize("frames", frameCost)
+    print "rest pose: %s" % ("reached" if not restMisses else "missed after %d packets" % restMisses)
+    return 1 if restMisses else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Logging that never blocks the packet or render loop on I/O.
+
+Callers write fixed-size records (time, message format, up to MAXARGS numbers)
+into a preallocated ring. A daemon thread formats and writes them out in the
+background, at most maxPerSecond lines a second; lines over the limit, and
+records overwritten before the thread got to them, are reported as counts.
+
+    import RingLog
+    log = RingLog.getLogger()
+    log.write("Trigger onset at sample %d of the packet", onset)
+"""
+import sys
+import time
+import threading
+import itertools
+import numpy
+
+MAXARGS = 4
+
+class RingLogger(object):
+    def __init__(self, capacity=1024, stream=None, maxPerSecond=50, interval=0.1):
+        self.capacity = capacity
+        self.times = numpy.zeros(capacity)
+        self.formats = numpy.zeros(capacity, dtype=int)
+        self.nargs = numpy.zeros(capacity, dtype=int)
+        self.args = numpy.zeros((capacity, MAXARGS))
+        self.seq = numpy.zeros(capacity, dtype=numpy.int64) #index+1 of the record in each slot, written last
+        self.formatList, self.formatIds = [], {}
+        self.formatLock = threading.Lock()
+        self.counter = itertools.count() #next() is atomic under the GIL, so writers need no lock
+        self.read = 0
+        self.head = 0
+        self.stream = stream or sys.stdout
+        self.maxPerSecond, self.interval = maxPerSecond, interval
+        self.dropped, self.suppressed = 0, 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def write(self, fmt, *args):
+        """Queue one message, fmt % args. Never blocks. The args must be numbers
+        (at most MAXARGS, extra ones are dropped) since they are kept in a float
+        array; put strings into fmt instead. Anything else raises TypeError
+        here, before the record is claimed, so the ring stays consistent."""
+        try:
+            values = [float(a) for a in args[:MAXARGS]]
+        except (TypeError, ValueError):
+            raise TypeError("RingLog.write takes numeric args only, got %r for %r" % (args, fmt))
+        fid = self.formatIds.get(fmt)
+        if fid is None:
+            with self.formatLock: #Only taken the first time a format is seen
+                fid = self.formatIds.get(fmt)
+                if fid is None:
+                    self.formatList.append(fmt)
+                    fid = self.formatIds[fmt] = len(self.formatList) - 1
+        i = self.counter.next()
+        slot = i % self.capacity
+        self.seq[slot] = 0 #Invalid while the fields are rewritten, so drain never takes a mix of two records
+        self.times[slot] = time.time()
+        self.formats[slot] = fid
+        n = len(values)
+        self.nargs[slot] = n
+        self.args[slot,:n] = values
+        self.seq[slot] = i + 1
+        self.head = i + 1 #Roughly the latest record; only used to catch up after being lapped
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.formatLock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='RingLog')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def openFile(self, path):
+        """Send the output to a file, appending, instead of the console."""
+        old, self.stream = self.stream, open(path, 'a')
+        if old not in (sys.stdout, sys.stderr):
+            old.close()
+
+    def flush(self):
+        """Write out whatever is queued and flush the output. The thread stops
+        meanwhile, so only one drain runs, and restarts with the next write."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            self.stopping.clear()
+        self.drain(limit=None)
+        self.stream.flush()
+
+    def close(self):
+        """Write out whatever is left, close the file and go back to the console."""
+        self.flush()
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+            self.stream = sys.stdout
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.drain(limit=int(self.maxPerSecond*self.interval) or 1)
+        self.drain(limit=None)
+
+    def drain(self, limit=None):
+        """Format and write the records queued so far, at most limit lines."""
+        lines = []
+        while True:
+            slot = self.read % self.capacity
+            seq = self.seq[slot]
+            if seq <= self.read:
+                break #Not written yet
+            if seq > self.read + 1: #The writers lapped the reader: go on from the oldest record still in the ring
+                skip = max(max(self.head, seq) - self.capacity - self.read, 1)
+                self.dropped += skip
+                self.read += skip
+                continue
+            if limit is None or len(lines) < limit:
+                t, fmt, n = self.times[slot], self.formatList[self.formats[slot]], self.nargs[slot]
+                args = tuple(self.args[slot,:n])
+                if self.seq[slot] == seq: #Not overwritten while it was being read
+                    lines.append("%s %s\n" % (time.strftime('%H:%M:%S', time.localtime(t)), fmt % args))
+                else:
+                    self.dropped += 1
+            else:
+                self.suppressed += 1
+            self.read += 1
+        if self.suppressed:
+            lines.append("(%d log messages suppressed)\n" % self.suppressed)
+            self.suppressed = 0
+        if self.dropped:
+            lines.append("(%d log messages lost to ring overflow)\n" % self.dropped)
+            self.dropped = 0
+        if lines:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+
+_logger = None
+
+def getLogger():
+    """The logger shared by the application and the renderer."""
+    global _logger
+    if _logger is None:
+        _logger = RingLogger()
+    return _logger
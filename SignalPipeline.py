@@ -0,0 +1,378 @@
+"""Streaming stages between the decoded BCI signal and the tail target.
+
+Every stage keeps O(1) state and is updated once per packet.
+"""
+import math
+import json
+import numpy
+from collections import deque
+import RingLog
+
+class AlphaBetaPredictor(object):
+    """Constant-velocity alpha-beta filter that extrapolates a target vector
+    horizon seconds past the time of the latest packet, to hide the delay
+    between a packet arriving and the pose reaching the screen.
+
+    Every prediction is kept until a packet arrives at or after the time it
+    was made for; the distance between the two is the prediction error,
+    summarised in lastError, maxError and rmsError. reset() restarts the
+    filter and keeps these; resetStats() clears them.
+
+    Times are packet times (samples so far over the sampling rate), so the
+    filter follows the signal however fast packets are delivered.
+    """
+    def __init__(self, horizon=0.05, alpha=0.5, beta=0.1):
+        self.horizon = horizon
+        self.alpha, self.beta = alpha, beta
+        self.reset()
+        self.resetStats()
+
+    def reset(self):
+        self.position, self.velocity, self.time = None, None, None
+        self.pending = deque()
+
+    def resetStats(self):
+        self.lastError, self.maxError = 0.0, 0.0
+        self.errorCount, self.errorSumSq = 0, 0.0
+
+    @property
+    def rmsError(self):
+        return math.sqrt(self.errorSumSq / self.errorCount) if self.errorCount else 0.0
+
+    def update(self, value, t):
+        """Feed the measurement value taken at time t (seconds) and return the
+        prediction for t + horizon."""
+        value = numpy.array(value, dtype=float)
+        while self.pending and self.pending[0][0] <= t:
+            predicted = self.pending.popleft()[1]
+            self.lastError = math.sqrt(((value - predicted)**2).sum())
+            self.maxError = max(self.maxError, self.lastError)
+            self.errorCount += 1
+            self.errorSumSq += self.lastError**2
+        if self.position is None or t <= self.time:
+            self.position, self.velocity = value, numpy.zeros_like(value)
+        else:
+            dt = t - self.time
+            predicted = self.position + self.velocity*dt
+            residual = value - predicted
+            self.position = predicted + self.alpha*residual
+            self.velocity = self.velocity + (self.beta/dt)*residual
+        self.time = t
+        prediction = self.position + self.velocity*self.horizon
+        if self.horizon > 0.0:
+            self.pending.append((t + self.horizon, prediction))
+        return prediction
+
+class SignalMapper(object):
+    """Maps the packet mean of each control channel to a workspace coordinate.
+
+    Channel k (row k of the packet) is clipped to [minThresh, maxThresh] and
+    mapped affinely onto ranges[k] = (low, high). The thresholds may be one
+    per channel. The gain and offset are computed once per setThresholds, so
+    map() costs one mean, one clip and one multiply-add for all dimensions
+    together.
+
+    A channel whose thresholds are less than minSpread apart (a normalizer that
+    saw a flat or inverted signal) keeps its previous thresholds, or is widened
+    to minSpread about their middle if it has none; either way it is logged.
+    """
+    minSpread = 1e-6
+
+    def __init__(self, minThresh, maxThresh, ranges):
+        self.ranges = numpy.array(ranges, dtype=float)
+        self.out = numpy.empty(len(self.ranges))
+        self.minThresh = self.maxThresh = None
+        self.setThresholds(minThresh, maxThresh)
+
+    def setThresholds(self, minThresh, maxThresh):
+        ranges = self.ranges
+        shape = (len(ranges),)
+        minThresh = numpy.array(numpy.broadcast_to(numpy.asarray(minThresh, dtype=float), shape))
+        maxThresh = numpy.array(numpy.broadcast_to(numpy.asarray(maxThresh, dtype=float), shape))
+        degenerate = ~(maxThresh - minThresh >= self.minSpread) #Also catches NaN
+        if degenerate.any():
+            RingLog.getLogger().write('SignalMapper: degenerate thresholds on %d of %d channels', degenerate.sum(), len(ranges))
+            if self.minThresh is not None:
+                minThresh[degenerate] = self.minThresh[degenerate]
+                maxThresh[degenerate] = self.maxThresh[degenerate]
+            else:
+                middle = numpy.nan_to_num(0.5*(minThresh + maxThresh))[degenerate]
+                minThresh[degenerate] = middle - 0.5*self.minSpread
+                maxThresh[degenerate] = middle + 0.5*self.minSpread
+        self.minThresh, self.maxThresh = minThresh, maxThresh
+        self.gain = (ranges[:,1] - ranges[:,0]) / (self.maxThresh - self.minThresh)
+        self.offset = ranges[:,0] - self.gain*self.minThresh
+
+    def map(self, sig):
+        """Return the workspace coordinates for a (channels x samples) packet.
+        The returned array is reused by the next call."""
+        sig = numpy.asarray(sig)
+        out = self.out
+        sig[:len(out)].mean(axis=1, out=out)
+        numpy.clip(out, self.minThresh, self.maxThresh, out=out)
+        out *= self.gain
+        out += self.offset
+        return out
+
+class OnlineNormalizer(object):
+    """Statistics of each control channel's packet mean, gathered one packet at
+    a time (from the baseline phase), that give the range to map it through.
+    A frozen normalizer ignores update(), so loaded statistics stay as saved."""
+    kind = None
+    fields = ()
+
+    def __init__(self, channels, minCount=10):
+        self.channels, self.minCount = channels, minCount
+        self.frozen = False
+        self.reset()
+
+    @property
+    def ready(self):
+        return self.count >= self.minCount
+
+    def getState(self):
+        state = {'kind': self.kind, 'channels': self.channels, 'minCount': self.minCount}
+        for name in self.fields:
+            value = getattr(self, name)
+            state[name] = value.tolist() if isinstance(value, numpy.ndarray) else value
+        return state
+
+    def setState(self, state):
+        for name in self.fields:
+            value = state[name]
+            setattr(self, name, numpy.array(value, dtype=float) if isinstance(value, list) else value)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.getState(), f, indent=1)
+
+class WelfordNormalizer(OnlineNormalizer):
+    """Running mean and variance (Welford's update); the range is the mean
+    plus or minus width standard deviations."""
+    kind = 'welford'
+    fields = ('width', 'count', 'mean', 'm2')
+
+    def __init__(self, channels, width=2.0, minCount=10):
+        self.width = width
+        OnlineNormalizer.__init__(self, channels, minCount)
+
+    def reset(self):
+        self.count = 0
+        self.mean, self.m2 = numpy.zeros(self.channels), numpy.zeros(self.channels)
+
+    def update(self, x):
+        if self.frozen:
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta*(x - self.mean)
+
+    def range(self):
+        spread = self.width*numpy.sqrt(self.m2 / max(self.count - 1, 1))
+        return self.mean - spread, self.mean + spread
+
+class QuantileNormalizer(OnlineNormalizer):
+    """Streaming estimates of the low and high quantiles (stochastic
+    approximation): every packet moves each estimate up by step*q or down by
+    step*(1 - q), for quantile q, depending on which side of it the packet
+    falls. The step is gain times the running standard deviation, so the
+    estimates settle at the scale of the signal."""
+    kind = 'quantile'
+    fields = ('low', 'high', 'gain', 'count', 'mean', 'm2', 'lowEstimate', 'highEstimate')
+
+    def __init__(self, channels, low=0.05, high=0.95, gain=0.05, minCount=10):
+        self.low, self.high, self.gain = low, high, gain
+        OnlineNormalizer.__init__(self, channels, minCount)
+
+    def reset(self):
+        self.count = 0
+        self.mean, self.m2 = numpy.zeros(self.channels), numpy.zeros(self.channels)
+        self.lowEstimate, self.highEstimate = numpy.zeros(self.channels), numpy.zeros(self.channels)
+
+    def update(self, x):
+        if self.frozen:
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta*(x - self.mean)
+        if self.count == 1:
+            self.lowEstimate[:], self.highEstimate[:] = x, x
+            return
+        step = self.gain*numpy.sqrt(self.m2 / (self.count - 1))
+        self.lowEstimate += step*(self.low - (x <= self.lowEstimate))
+        self.highEstimate += step*(self.high - (x <= self.highEstimate))
+
+    def range(self):
+        return self.lowEstimate.copy(), self.highEstimate.copy()
+
+def makeNormalizer(kind, channels, width=2.0, quantile=0.05, minCount=10):
+    """Normalizer by name: 'none' (None), 'welford' (mean +- width standard
+    deviations) or 'quantile' (the quantile and 1 - quantile)."""
+    kind = kind.lower()
+    if kind in ('', 'none'):
+        return None
+    elif kind == 'welford':
+        return WelfordNormalizer(channels, width, minCount)
+    elif kind == 'quantile':
+        return QuantileNormalizer(channels, quantile, 1.0 - quantile, minCount=minCount)
+    raise ValueError('normalizer "%s" is unsupported' % kind)
+
+def loadNormalizer(path):
+    """A frozen normalizer with the statistics saved at path."""
+    with open(path) as f:
+        state = json.load(f)
+    normalizer = makeNormalizer(state['kind'], state['channels'], minCount=state['minCount'])
+    normalizer.setState(state)
+    normalizer.frozen = True
+    return normalizer
+
+class ExponentialSmoother(object):
+    """First-order low-pass (exponential moving average) with a cutoff in Hz."""
+    def __init__(self, cutoff, rate):
+        self.alpha = 1.0 - math.exp(-2*math.pi*cutoff/rate)
+        self.reset()
+
+    def reset(self):
+        self.value = None
+
+    def update(self, x):
+        if self.value is None:
+            self.value = numpy.array(x, dtype=float)
+        else:
+            self.value += self.alpha*(x - self.value)
+        return self.value
+
+class OneEuroFilter(object):
+    """One-euro filter (Casiez et al. 2012): an exponential smoother whose
+    cutoff rises from minCutoff with the signal speed, scaled by beta, so
+    slow drifts are smoothed hard while fast movements lag little."""
+    def __init__(self, rate, minCutoff=1.0, beta=0.0, dCutoff=1.0):
+        self.rate = rate
+        self.minCutoff, self.beta = minCutoff, beta
+        self.dAlpha = self._alpha(dCutoff)
+        self.reset()
+
+    def _alpha(self, cutoff):
+        tau = 1.0 / (2*math.pi*cutoff)
+        return 1.0 / (1.0 + tau*self.rate)
+
+    def reset(self):
+        self.value, self.speed = None, None
+
+    def update(self, x):
+        x = numpy.asarray(x, dtype=float)
+        if self.value is None:
+            self.value, self.speed = x.copy(), numpy.zeros_like(x)
+            return self.value
+        self.speed += self.dAlpha*((x - self.value)*self.rate - self.speed)
+        cutoff = self.minCutoff + self.beta*numpy.abs(self.speed)
+        alpha = 1.0 / (1.0 + self.rate/(2*math.pi*cutoff))
+        self.value += alpha*(x - self.value)
+        return self.value
+
+class BiquadLowpass(object):
+    """Second-order Butterworth low-pass (RBJ biquad, transposed direct form II).
+    The state starts settled on the first input, so there is no start-up transient."""
+    def __init__(self, cutoff, rate, q=1/math.sqrt(2)):
+        w = 2*math.pi*cutoff/rate
+        alpha = math.sin(w)/(2*q)
+        a0 = 1 + alpha
+        self.b0 = self.b2 = (1 - math.cos(w))/2/a0
+        self.b1 = (1 - math.cos(w))/a0
+        self.a1 = -2*math.cos(w)/a0
+        self.a2 = (1 - alpha)/a0
+        self.reset()
+
+    def reset(self):
+        self.z1, self.z2 = None, None
+
+    def update(self, x):
+        x = numpy.asarray(x, dtype=float)
+        if self.z1 is None:
+            self.z1, self.z2 = x*(1 - self.b0), x*(self.b2 - self.a2)
+        y = self.b0*x + self.z1
+        self.z1 = self.b1*x - self.a1*y + self.z2
+        self.z2 = self.b2*x - self.a2*y
+        return y
+
+class PassThrough(object):
+    def reset(self):
+        pass
+
+    def update(self, x):
+        return x
+
+def makeFilter(kind, rate, cutoff=2.0, beta=0.0):
+    """Smoothing stage by name: 'none', 'ema', 'oneeuro' or 'biquad'.
+    rate is the packet rate in Hz; cutoff is in Hz (the minimum cutoff for
+    'oneeuro'); beta is the one-euro speed coefficient."""
+    kind = kind.lower().replace('-', '').replace('_', '')
+    if kind in ('', 'none'):
+        return PassThrough()
+    elif kind == 'ema':
+        return ExponentialSmoother(cutoff, rate)
+    elif kind == 'oneeuro':
+        return OneEuroFilter(rate, cutoff, beta)
+    elif kind == 'biquad':
+        return BiquadLowpass(cutoff, rate)
+    raise ValueError('target filter "%s" is unsupported' % kind)
+
+class TriggerDetector(object):
+    """Schmitt trigger run on every sample of one channel.
+
+    A candidate starts when the signal rises above upper and is dropped if it
+    falls back to lower before minDwell seconds have passed; otherwise the
+    detector fires. It then stays disarmed until the signal has returned to
+    lower and refractory seconds have passed since the onset. Samples are
+    counted from reset(), and onset is the index of the first sample of the
+    run that fired.
+    """
+    def __init__(self, upper, lower, rate, minDwell=0.0, refractory=0.0):
+        if lower > upper:
+            raise ValueError('lower trigger threshold %g is above the upper one %g' % (lower, upper))
+        self.upper, self.lower = upper, lower
+        self.dwell = max(1, int(round(minDwell*rate)))
+        self.refractory = int(round(refractory*rate))
+        self.reset()
+
+    def reset(self):
+        self.armed, self.released = True, True
+        self.count = 0
+        self.runStart = None
+        self.onset = None
+        self.fired = 0
+
+    def update(self, x):
+        """Feed one packet of samples. Return the index within the packet of
+        the onset of the first trigger it completes (negative if the run began
+        in an earlier packet), or None."""
+        x = numpy.asarray(x, dtype=float).ravel()
+        start = self.count
+        self.count += len(x)
+        if self.armed and self.runStart is None and not (x > self.upper).any():
+            return None
+        if not self.armed and not self.released and not (x <= self.lower).any():
+            return None
+        first = None
+        for i, v in enumerate(x):
+            k = start + i
+            if not self.armed:
+                if v <= self.lower:
+                    self.released = True
+                if not (self.released and k >= self.onset + self.refractory):
+                    continue
+                self.armed = True
+            if self.runStart is None:
+                if v > self.upper:
+                    self.runStart = k
+            elif v <= self.lower:
+                self.runStart = None
+            if self.runStart is not None and k - self.runStart + 1 >= self.dwell:
+                self.onset, self.runStart = self.runStart, None
+                self.armed, self.released = False, False
+                self.fired += 1
+                if first is None:
+                    first = self.onset - start
+        return first
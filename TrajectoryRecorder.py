@@ -0,0 +1,112 @@
+"""Per-packet recording of the feedback trajectory for offline analysis.
+
+A recording is a directory with one raw binary file per column and a small
+header.json naming the columns, their dtypes, the number of rows written and
+the labels of label columns (stored as int16 codes). Columns are memory-mapped
+and grown by whole chunks, so append() is a handful of array stores, and
+readRecording() hands back NumPy memmap views of the files without copying.
+The header is rewritten every headerInterval rows and whenever a new label
+appears, so a reader during the run, or after a crash, finds all but at most
+headerInterval - 1 of the rows written.
+
+    rec = TrajectoryRecorder('run1', [('time', 'f8'), ('vx', 'f4'), ('phase', 'label')])
+    rec.append((time.time(), vx, phase))
+    rec.close()
+    data, labels = readRecording('run1')
+"""
+import os
+import json
+import numpy
+
+LABEL = 'label'
+
+class TrajectoryRecorder(object):
+    def __init__(self, path, fields, chunk=65536, headerInterval=50):
+        """fields is a list of (name, dtype) in the order append() takes
+        values; dtype 'label' stores strings as small integer codes."""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path, self.chunk, self.headerInterval = path, chunk, headerInterval
+        self.newLabel = False #A label was coded since the header was written
+        self.names = [name for name, dtype in fields]
+        self.dtypes = [numpy.dtype('i2') if dtype == LABEL else numpy.dtype(dtype) for name, dtype in fields]
+        self.labels = dict((name, {}) for name, dtype in fields if dtype == LABEL)
+        self.isLabel = [dtype == LABEL for name, dtype in fields]
+        self.files = [open(os.path.join(path, name + '.bin'), 'w+b') for name in self.names]
+        self.count, self.capacity = 0, 0
+        self.columns = []
+        self.grow()
+        self.writeHeader()
+
+    def grow(self):
+        """Extend every column file by one chunk and map it again."""
+        self.capacity += self.chunk
+        self.columns = []
+        for f, dtype in zip(self.files, self.dtypes):
+            f.truncate(self.capacity * dtype.itemsize)
+            self.columns.append(numpy.memmap(f, dtype=dtype, mode='r+', shape=(self.capacity,)))
+
+    def code(self, name, label):
+        codes = self.labels[name]
+        c = codes.get(label)
+        if c is None:
+            c = codes[label] = len(codes)
+            self.newLabel = True
+        return c
+
+    def append(self, values):
+        """Write one row; values are in the order of the fields."""
+        if self.count == self.capacity:
+            self.flush()
+            self.grow()
+        n = self.count
+        for name, column, isLabel, v in zip(self.names, self.columns, self.isLabel, values):
+            column[n] = self.code(name, v) if isLabel else v
+        self.count = n + 1
+        if self.newLabel or self.count % self.headerInterval == 0:
+            self.writeHeader() #The mapped pages are already visible to readers; a crash of this process keeps them
+
+    def writeHeader(self):
+        self.newLabel = False
+        header = {'count': self.count,
+                  'fields': [(name, dtype.str) for name, dtype in zip(self.names, self.dtypes)],
+                  'labels': dict((name, sorted(codes, key=codes.get)) for name, codes in self.labels.items())}
+        tmp = os.path.join(self.path, 'header.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(header, f)
+        if os.path.exists(os.path.join(self.path, 'header.json')):
+            os.remove(os.path.join(self.path, 'header.json')) #rename does not replace on Windows
+        os.rename(tmp, os.path.join(self.path, 'header.json'))
+
+    def flush(self):
+        """Push the mapped pages to disk and record how many rows are valid."""
+        for column in self.columns:
+            column.flush()
+        self.writeHeader()
+
+    def close(self):
+        """Flush, trim the files to the rows written and close them."""
+        if self.files is None:
+            return
+        self.flush()
+        self.columns = []
+        for f, dtype in zip(self.files, self.dtypes):
+            f.truncate(self.count * dtype.itemsize)
+            f.close()
+        self.files = None
+
+def readRecording(path):
+    """Return ({name: array}, {name: labels}) for a recording. Arrays are
+    read-only memory maps holding the rows counted in the header; a label
+    column's codes index its labels list."""
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    count = header['count']
+    data = {}
+    for name, dtype in header['fields']:
+        dtype = numpy.dtype(str(dtype))
+        if count:
+            data[name] = numpy.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(count,))
+        else:
+            data[name] = numpy.zeros(0, dtype=dtype)
+    return data, header['labels']
@@ -0,0 +1,56 @@
+"""The tail through OgreRenderer on the headless backend."""
+import os
+import sys
+import unittest
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Replay
+Replay.installStandIns() #For BCPy2000's Coords, if it is not installed
+import OgreRenderer
+import QuaternionMath
+
+class HeadlessTailTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.screen = OgreRenderer.OgreRenderer()
+        cls.screen.setup(headless=True, framerate=60.0)
+        cls.screen.Initialize()
+        cls.tail = OgreRenderer.TailStimulus(ikCacheSize=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.screen.Cleanup()
+
+    def frames(self, n):
+        for i in range(n):
+            self.screen.FinishFrame()
+
+    def testBackend(self):
+        self.assertEqual(OgreRenderer.ogre.module.__name__, 'HeadlessOgre')
+
+    def testTargetIsReached(self):
+        self.tail.setTarget(-15.0, 10.0, 0.1)
+        self.frames(20) #A third of a second
+        angle0, angle = OgreRenderer.TailKinematics.solveArc(len(self.tail.bones), self.tail.bones[1].position.y, -15.0, 10.0)
+        q = OgreRenderer.quatToArray(self.tail.bones[1].getOrientation())
+        self.assertTrue(numpy.allclose(abs(QuaternionMath.dot(q, QuaternionMath.fromAngleZ(angle))), 1.0, atol=1e-6))
+
+    def testRestPose(self):
+        self.tail.setTarget(-15.0, 10.0, 0.1)
+        self.tail.setTarget(0.0, 0.0, 0.1, default=True)
+        self.frames(20)
+        self.assertEqual(self.tail.lastTarget, self.tail.restPose)
+
+    def testRepeatedTargetSkipped(self):
+        ik = self.tail.inverseKinematics
+        self.assertTrue(ik(True, False, -12.0, 12.0, 0.1))
+        self.assertFalse(ik(True, False, -12.0, 12.0, 0.1))
+        self.assertTrue(ik(True, False, -12.0, 12.0, 0.2)) #Same target, new duration
+
+    def testFrameTimes(self):
+        self.screen.resetFrameStatistics()
+        self.frames(10)
+        self.assertEqual(self.screen.frameStatistics()['frames'], 9)
+
+if __name__ == '__main__':
+    unittest.main()
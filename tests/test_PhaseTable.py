@@ -0,0 +1,68 @@
+"""PhaseTable writes only what changes, and defaults for phases without a row."""
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PhaseTable import PhaseTable
+
+class Stimulus(object):
+    def __init__(self):
+        self.writes = []
+
+    def __setattr__(self, name, value):
+        if name != 'writes':
+            self.writes.append((name, value))
+        object.__setattr__(self, name, value)
+
+class App(object):
+    def __init__(self):
+        self.states, self.stimuli = {}, {'cue': Stimulus()}
+        self.phases, self.start = {}, None
+
+    def phase(self, name, next, duration):
+        self.phases[name] = (next, duration)
+
+    def design(self, start, **kwargs):
+        self.start = start
+
+def table():
+    return PhaseTable([
+        dict(name='gocue', next='task', duration=1000, states={'GoCue': 1}, stimuli={'cue': {'text': 'Go', 'on': True}}),
+        dict(name='task', next='gocue', duration=6000, branch='gocue', states={'Task': 1}),
+        ], states=['GoCue', 'Task'], stimuli={'cue': {'on': False}})
+
+class PhaseTableTest(unittest.TestCase):
+    def testDefine(self):
+        app = App()
+        table().define(app)
+        self.assertEqual(app.start, 'gocue')
+        self.assertEqual(app.phases, {'gocue': ('task', 1000), 'task': ('gocue', 6000)})
+
+    def testEnterWritesChanges(self):
+        app, phases = App(), table()
+        phases.enter('gocue', app)
+        self.assertEqual(app.states, {'GoCue': 1, 'Task': 0})
+        cue = app.stimuli['cue']
+        del cue.writes[:]
+        phases.enter('task', app)
+        self.assertEqual(app.states, {'GoCue': 0, 'Task': 1})
+        self.assertEqual(cue.writes, [('on', False)]) #text stays as it is
+        self.assertEqual(phases.branch('task'), 'gocue')
+
+    def testPhaseWithoutRowGetsDefaults(self):
+        app, phases = App(), table()
+        phases.enter('gocue', app)
+        phases.enter('intertrial', app)
+        self.assertEqual(app.states, {'GoCue': 0, 'Task': 0})
+        self.assertFalse(app.stimuli['cue'].on)
+
+    def testResetWritesEverything(self):
+        app, phases = App(), table()
+        phases.enter('task', app)
+        app.states['Task'] = 0 #Changed behind the table's back
+        phases.reset()
+        phases.enter('task', app)
+        self.assertEqual(app.states['Task'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""PoseChannel hands over the latest target once."""
+import os
+import sys
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PoseChannel import PoseChannel
+
+class PoseChannelTest(unittest.TestCase):
+    def testEmpty(self):
+        self.assertIsNone(PoseChannel().take())
+
+    def testLatestOnce(self):
+        channel = PoseChannel()
+        channel.publish(1.0, 2.0, 0.12, 10.0, 0.5)
+        channel.publish(3.0, 4.0, 1.0, 11.0, 0.52, default=True)
+        self.assertEqual(channel.take(), (3.0, 4.0, 1.0, 11.0, 0.52, 1.0))
+        self.assertIsNone(channel.take())
+        self.assertEqual(channel.superseded, 1)
+
+    def testConcurrentTargetsAreWhole(self):
+        channel = PoseChannel()
+        taken = []
+        def read():
+            while not taken or taken[-1][0] < 19999:
+                target = channel.take()
+                if target is not None:
+                    taken.append(target)
+        reader = threading.Thread(target=read)
+        reader.start()
+        for k in range(20000):
+            channel.publish(k, -k, k, 2*k, 3*k)
+        reader.join()
+        for vx, vy, duration, stamp, t, default in taken:
+            self.assertEqual((vy, duration, stamp, t), (-vx, vx, 2*vx, 3*vx))
+        self.assertEqual([target[0] for target in taken], sorted(target[0] for target in taken))
+        self.assertEqual(len(taken) + channel.superseded, 20000)
+
+if __name__ == '__main__':
+    unittest.main()
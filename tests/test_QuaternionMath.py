@@ -0,0 +1,97 @@
+"""QuaternionMath against reference values and rotation matrices."""
+import os
+import sys
+import math
+import unittest
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import QuaternionMath
+
+def rotationX(a):
+    c, s = math.cos(a), math.sin(a)
+    return numpy.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+def rotationY(a):
+    c, s = math.cos(a), math.sin(a)
+    return numpy.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+def rotationZ(a):
+    c, s = math.cos(a), math.sin(a)
+    return numpy.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+class QuaternionMathTest(unittest.TestCase):
+    def assertClose(self, a, b, tol=1e-12):
+        self.assertTrue(numpy.allclose(a, b, rtol=0, atol=tol), "%r != %r" % (a, b))
+
+    def testIdentity(self):
+        self.assertClose(QuaternionMath.identity(), (1, 0, 0, 0))
+        self.assertEqual(QuaternionMath.identity(30).shape, (30, 4))
+
+    def testFromAngleZ(self):
+        h = math.sqrt(0.5)
+        self.assertClose(QuaternionMath.fromAngleZ(math.pi/2), (h, 0, 0, h))
+        self.assertClose(QuaternionMath.fromAngleZ(math.pi), (0, 0, 0, 1))
+
+    def testMultiplyUnits(self):
+        i, j, k = (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1)
+        self.assertClose(QuaternionMath.multiply(i, j), k)
+        self.assertClose(QuaternionMath.multiply(j, i), numpy.negative(k))
+        self.assertClose(QuaternionMath.multiply(k, k), (-1, 0, 0, 0))
+
+    def testMultiplyInPlace(self):
+        a = QuaternionMath.fromAngleZ(0.3)
+        b = QuaternionMath.fromAngleZ(0.4)
+        QuaternionMath.multiply(a, b, out=a)
+        self.assertClose(a, QuaternionMath.fromAngleZ(0.7))
+
+    def testRotate(self):
+        q = QuaternionMath.fromAngleZ(math.pi/2)
+        self.assertClose(QuaternionMath.rotate(q, (1, 0, 0)), (0, 1, 0))
+        self.assertClose(QuaternionMath.rotate(q, (0, 0, 2)), (0, 0, 2))
+
+    def testFromEulerXYZMatchesMatrices(self):
+        rng = numpy.random.RandomState(0)
+        for x, y, z in rng.uniform(-math.pi, math.pi, (20, 3)):
+            q = QuaternionMath.fromEulerXYZ(x, y, z)
+            m = rotationX(x).dot(rotationY(y)).dot(rotationZ(z))
+            for v in numpy.eye(3):
+                self.assertClose(QuaternionMath.rotate(q, v), m.dot(v), 1e-9)
+
+    def testConjugateInverts(self):
+        q = QuaternionMath.fromEulerXYZ(0.1, -0.7, 1.2)
+        self.assertClose(QuaternionMath.multiply(q, QuaternionMath.conjugate(q)), (1, 0, 0, 0))
+
+    def testFromTo(self):
+        a, b = numpy.array([1.0, 0, 0]), numpy.array([0, 0.6, 0.8])
+        self.assertClose(QuaternionMath.rotate(QuaternionMath.fromTo(a, b), a), b)
+
+    def testFromToOpposite(self):
+        for a in ((1.0, 0, 0), (0, 1.0, 0), (0, 0, -1.0)):
+            a = numpy.array(a)
+            q = QuaternionMath.fromTo(a, -a)
+            self.assertTrue(numpy.isfinite(q).all())
+            self.assertClose(QuaternionMath.rotate(q, a), -a)
+
+    def testSlerp(self):
+        a, b = QuaternionMath.identity(), QuaternionMath.fromAngleZ(math.pi/2)
+        self.assertClose(QuaternionMath.slerp(0.0, a, b), a)
+        self.assertClose(QuaternionMath.slerp(1.0, a, b), b)
+        self.assertClose(QuaternionMath.slerp(0.5, a, b), QuaternionMath.fromAngleZ(math.pi/4))
+
+    def testSlerpShortestPath(self):
+        a, b = QuaternionMath.identity(), -QuaternionMath.fromAngleZ(0.2)
+        self.assertClose(QuaternionMath.slerp(0.5, a, b, shortestPath=True), QuaternionMath.fromAngleZ(0.1))
+
+    def testSlerpNearlyParallel(self):
+        a, b = QuaternionMath.identity(), QuaternionMath.fromAngleZ(1e-6)
+        q = QuaternionMath.slerp(0.5, a, b)
+        self.assertAlmostEqual(QuaternionMath.dot(q, q), 1.0)
+
+    def testBroadcast(self):
+        angles = numpy.linspace(0, 1, 5)
+        q = QuaternionMath.fromAngleZ(angles)
+        r = QuaternionMath.multiply(q, QuaternionMath.fromAngleZ(0.5))
+        self.assertClose(r, QuaternionMath.fromAngleZ(angles + 0.5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""Smoke run of KiPAS through Replay, headless."""
+import os
+import sys
+import unittest
+import StringIO
+import numpy
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import RingLog
+import Replay
+
+def signal(rate=1000.0, seconds=20.0):
+    """Channel 1 triggers at 1.5 s; channel 2 sweeps the control range."""
+    t = numpy.arange(int(rate*seconds)) / rate
+    sig = numpy.zeros((2, len(t)))
+    sig[0, (t >= 1.5) & (t < 1.55)] = 1.5
+    sig[1] = 0.5 + 0.5*numpy.sin(2*numpy.pi*0.3*t)
+    return sig
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.logger, RingLog._logger = RingLog._logger, RingLog.RingLogger(stream=StringIO.StringIO())
+
+    def tearDown(self):
+        RingLog._logger.close()
+        RingLog._logger = self.logger
+
+    def testKiPAS(self):
+        app = Replay.loadApplication(os.path.join(ROOT, 'KiPAS.py'), 1000.0, 20)
+        phases = []
+        transition = app.Transition
+        def record(phase):
+            phases.append(phase)
+            transition(phase)
+        app.Transition = record
+        packetCost, frameCost, restMisses = Replay.replay(app, signal(), 20)
+        self.assertEqual(len(packetCost), 1000)
+        self.assertAlmostEqual(len(frameCost), 1200, delta=1) #60 fps over 20 s
+        self.assertEqual(restMisses, 0)
+        self.assertEqual(phases[:6], ['preRun', 'triggerJudge', 'relaxcue', 'baseline', 'gocue', 'task'])
+        self.assertAlmostEqual(app.screen.frameStatistics()['frames'], len(frameCost), delta=2) #Headless frames are timed too
+        RingLog._logger.flush()
+        self.assertIn('Latency packet to presented', RingLog._logger.stream.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
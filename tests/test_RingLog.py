@@ -0,0 +1,73 @@
+"""RingLog formatting, wraparound and argument checks."""
+import os
+import sys
+import threading
+import unittest
+import StringIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import RingLog
+
+class RingLogTest(unittest.TestCase):
+    def logger(self, capacity=8):
+        #A long interval keeps the thread from draining until flush()
+        return RingLog.RingLogger(capacity, stream=StringIO.StringIO(), interval=60.0)
+
+    def messages(self, logger):
+        logger.flush()
+        return [line if line.startswith('(') else line.split(' ', 1)[1] for line in logger.stream.getvalue().splitlines()]
+
+    def testFormat(self):
+        logger = self.logger()
+        logger.write("frame %d took %.2f ms", 3, 1.234)
+        logger.write("no args")
+        self.assertEqual(self.messages(logger), ["frame 3 took 1.23 ms", "no args"])
+
+    def testWraparoundKeepsNewestInOrder(self):
+        logger = self.logger()
+        for i in range(30):
+            logger.write("%d", i)
+        self.assertEqual(self.messages(logger), [str(i) for i in range(22, 30)] + ["(22 log messages lost to ring overflow)"])
+
+    def testWraparoundAfterDrain(self):
+        logger = self.logger()
+        for i in range(5):
+            logger.write("%d", i)
+        logger.flush()
+        for i in range(5, 25):
+            logger.write("%d", i)
+        self.assertEqual(self.messages(logger)[-9:], [str(i) for i in range(17, 25)] + ["(12 log messages lost to ring overflow)"])
+
+    def testRateLimit(self):
+        logger = self.logger(capacity=64)
+        logger.maxPerSecond = 20 #Two lines per 0.1 s drain
+        for i in range(5):
+            logger.write("%d", i)
+        logger.flush() #Unlimited
+        logger.stream.truncate(0)
+        for i in range(5):
+            logger.write("%d", i)
+        logger.drain(limit=2)
+        self.assertEqual(self.messages(logger), ["0", "1", "(3 log messages suppressed)"])
+
+    def testNonNumericArgs(self):
+        logger = self.logger()
+        self.assertRaises(TypeError, logger.write, "%s", "text")
+        logger.write("%d", 1) #The ring is still usable
+        self.assertEqual(self.messages(logger), ["1"])
+
+    def testConcurrentWritersNeverMix(self):
+        logger = self.logger()
+        def write():
+            for i in range(5000):
+                logger.write("%d %d %d", i, i, i)
+        threads = [threading.Thread(target=write) for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for line in self.messages(logger):
+            if not line.startswith('('):
+                self.assertEqual(len(set(line.split())), 1, line)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Edge cases of the streaming stages between the signal and the tail target."""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import StringIO
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import RingLog
+import SignalPipeline
+
+class SignalMapperTest(unittest.TestCase):
+    def setUp(self):
+        self.logger, RingLog._logger = RingLog._logger, RingLog.RingLogger(stream=StringIO.StringIO())
+
+    def tearDown(self):
+        RingLog._logger.flush()
+        RingLog._logger = self.logger
+
+    def testMapAndClip(self):
+        mapper = SignalPipeline.SignalMapper(0.0, 1.0, [(-23.0, -8.0), (3.0, 18.0)])
+        sig = numpy.array([[0.5]*4, [2.0]*4])
+        self.assertTrue(numpy.allclose(mapper.map(sig), (-15.5, 18.0)))
+
+    def testDegenerateKeepsPrevious(self):
+        mapper = SignalPipeline.SignalMapper([0.0, 0.0], [1.0, 1.0], [(0.0, 1.0), (0.0, 1.0)])
+        mapper.setThresholds([0.2, 0.5], [0.8, 0.5])
+        self.assertTrue(numpy.allclose(mapper.minThresh, (0.2, 0.0)))
+        self.assertTrue(numpy.allclose(mapper.maxThresh, (0.8, 1.0)))
+        mapper.setThresholds([0.0, 1.0], [1.0, 0.0]) #Inverted
+        self.assertTrue(numpy.allclose(mapper.maxThresh, (1.0, 1.0)))
+        self.assertTrue(numpy.isfinite(mapper.gain).all())
+        RingLog._logger.flush()
+        self.assertIn('degenerate thresholds', RingLog._logger.stream.getvalue())
+
+    def testDegenerateWithoutPrevious(self):
+        mapper = SignalPipeline.SignalMapper(0.5, 0.5, [(0.0, 1.0)])
+        self.assertTrue(numpy.isfinite(mapper.gain).all())
+        self.assertTrue(numpy.allclose(mapper.map(numpy.array([[0.5]])), 0.5))
+
+class NormalizerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testWelford(self):
+        normalizer = SignalPipeline.makeNormalizer('welford', 2, width=1.0, minCount=3)
+        data = numpy.random.RandomState(2).normal((1.0, -2.0), (0.5, 3.0), (500, 2))
+        for x in data[:2]:
+            normalizer.update(x)
+        self.assertFalse(normalizer.ready)
+        for x in data[2:]:
+            normalizer.update(x)
+        low, high = normalizer.range()
+        self.assertTrue(numpy.allclose((high - low)/2.0, data.std(axis=0, ddof=1)))
+
+    def testQuantileSettles(self):
+        normalizer = SignalPipeline.makeNormalizer('quantile', 1, quantile=0.1)
+        for x in numpy.random.RandomState(3).uniform(0.0, 1.0, (5000, 1)):
+            normalizer.update(x)
+        low, high = normalizer.range()
+        self.assertAlmostEqual(low[0], 0.1, delta=0.05)
+        self.assertAlmostEqual(high[0], 0.9, delta=0.05)
+
+    def testSaveLoadFrozen(self):
+        normalizer = SignalPipeline.makeNormalizer('welford', 2)
+        for x in numpy.random.RandomState(4).normal(size=(20, 2)):
+            normalizer.update(x)
+        path = os.path.join(self.dir, 'normalizer.json')
+        normalizer.save(path)
+        loaded = SignalPipeline.loadNormalizer(path)
+        self.assertTrue(loaded.frozen)
+        loaded.update(numpy.array([100.0, 100.0]))
+        self.assertTrue(numpy.allclose(loaded.range(), normalizer.range()))
+
+    def testNone(self):
+        self.assertIsNone(SignalPipeline.makeNormalizer('none', 2))
+        self.assertRaises(ValueError, SignalPipeline.makeNormalizer, 'median', 2)
+
+class FilterTest(unittest.TestCase):
+    def testSteadyState(self):
+        for kind in ('none', 'ema', 'oneeuro', 'biquad'):
+            smoother = SignalPipeline.makeFilter(kind, 50.0, cutoff=2.0)
+            for i in range(500):
+                out = smoother.update(numpy.array([1.0, -2.0]))
+            self.assertTrue(numpy.allclose(out, (1.0, -2.0), atol=1e-6), kind)
+
+class AlphaBetaPredictorTest(unittest.TestCase):
+    def testRampIsPredicted(self):
+        predictor = SignalPipeline.AlphaBetaPredictor(horizon=0.1)
+        for k in range(200):
+            t = k*0.02
+            prediction = predictor.update((t, 2.0*t), t)
+        self.assertTrue(numpy.allclose(prediction, (t + 0.1, 2.0*(t + 0.1)), atol=1e-3))
+        self.assertLess(predictor.lastError, 1e-3)
+
+    def testResetKeepsStats(self):
+        predictor = SignalPipeline.AlphaBetaPredictor(horizon=0.02)
+        for k in range(10):
+            predictor.update((k*0.1,), k*0.02)
+        count = predictor.errorCount
+        predictor.reset()
+        self.assertEqual(predictor.errorCount, count)
+        predictor.resetStats()
+        self.assertEqual((predictor.errorCount, predictor.rmsError), (0, 0.0))
+
+class TriggerDetectorTest(unittest.TestCase):
+    def testThresholds(self):
+        self.assertRaises(ValueError, SignalPipeline.TriggerDetector, 0.2, 0.5, 1000.0)
+
+    def testOnsetWithinPacket(self):
+        detector = SignalPipeline.TriggerDetector(0.5, 0.2, 1000.0)
+        x = numpy.zeros(20)
+        x[7:] = 1.0
+        self.assertEqual(detector.update(x), 7)
+
+    def testDwellAcrossPackets(self):
+        detector = SignalPipeline.TriggerDetector(0.5, 0.2, 1000.0, minDwell=0.015)
+        x = numpy.zeros(20)
+        x[10:] = 1.0
+        self.assertIsNone(detector.update(x))
+        self.assertEqual(detector.update(numpy.ones(20)), -10) #Began in the previous packet
+
+    def testShortRunDropped(self):
+        detector = SignalPipeline.TriggerDetector(0.5, 0.2, 1000.0, minDwell=0.01)
+        x = numpy.zeros(20)
+        x[2:6] = 1.0
+        self.assertIsNone(detector.update(x))
+        self.assertEqual(detector.fired, 0)
+
+    def testRefractory(self):
+        detector = SignalPipeline.TriggerDetector(0.5, 0.2, 1000.0, refractory=0.05)
+        pulse = numpy.zeros(20)
+        pulse[0:3] = 1.0
+        self.assertEqual(detector.update(pulse), 0)
+        self.assertIsNone(detector.update(pulse)) #20 samples after the onset: still refractory
+        self.assertIsNone(detector.update(numpy.zeros(20)))
+        self.assertEqual(detector.update(pulse), 0)
+        self.assertEqual(detector.fired, 2)
+
+    def testHeldHighFiresOnce(self):
+        detector = SignalPipeline.TriggerDetector(0.5, 0.2, 1000.0)
+        self.assertEqual(detector.update(numpy.ones(20)), 0)
+        self.assertIsNone(detector.update(numpy.ones(20)))
+        self.assertEqual(detector.fired, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Tail IK: the arc solvers, the IK table's error bound and FABRIK."""
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import TailKinematics
+
+N, d = 30, 1.0 #The tail skeleton
+XPOS, YPOS = (-23.0, -8.0), (3.0, 18.0) #The KiPAS workspace
+
+def chord(theta):
+    theta = abs(theta)
+    return d*math.sin(N*theta/2.0)/math.sin(theta/2.0)
+
+class ArcTest(unittest.TestCase):
+    def testSolveArcChord(self):
+        for vx, vy in ((-8.0, 18.0), (-15.0, 10.0), (-23.0, 3.0), (-20.0, 18.0)):
+            angle0, angle = TailKinematics.solveArc(N, d, vx, vy)
+            self.assertAlmostEqual(chord(angle), math.hypot(vx, vy), places=6)
+
+    def testArcSolverAgrees(self):
+        solver = TailKinematics.ArcSolver(N, d)
+        for vx, vy in ((-8.0, 18.0), (-15.0, 10.0), (-23.0, 3.0)):
+            exact = TailKinematics.solveArc(N, d, vx, vy, iterations=50)
+            self.assertTrue(numpy.allclose(solver.solve(vx, vy), exact, atol=1e-6))
+            self.assertTrue(solver.converged)
+
+    def testArcSolverClamps(self):
+        solver = TailKinematics.ArcSolver(N, d)
+        for vx, vy in ((0.0, 0.0), (100.0, 100.0)):
+            angles = solver.solve(vx, vy)
+            self.assertTrue(solver.clamped)
+            self.assertTrue(numpy.isfinite(angles).all())
+
+    def testBatchMatchesScalar(self):
+        vx, vy = numpy.array([-8.0, -15.0, -20.0]), numpy.array([18.0, 10.0, 5.0])
+        angle0, angle = TailKinematics.solveArcBatch(N, d, vx, vy)
+        for k in range(len(vx)):
+            self.assertTrue(numpy.allclose((angle0[k], angle[k]), TailKinematics.solveArc(N, d, vx[k], vy[k])))
+
+class IKTableTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.table = TailKinematics.IKTable(N, d, XPOS, YPOS)
+
+    def testErrorBound(self):
+        self.assertLess(self.table.maxError, 1e-3) #About 9.4e-4 rad on the 0.25 unit grid
+        rng = numpy.random.RandomState(1)
+        for vx, vy in zip(rng.uniform(XPOS[0], XPOS[1], 200), rng.uniform(YPOS[0], YPOS[1], 200)):
+            exact = TailKinematics.solveArc(N, d, vx, vy)
+            error = numpy.abs(numpy.subtract(self.table.lookup(vx, vy), exact)).max()
+            self.assertLessEqual(error, self.table.maxError*1.05)
+
+    def testNodesAreExact(self):
+        vx, vy = self.table.xs[3], self.table.ys[5]
+        self.assertTrue(numpy.allclose(self.table.lookup(vx, vy), TailKinematics.solveArc(N, d, vx, vy)))
+
+    def testCovers(self):
+        self.assertTrue(self.table.covers(XPOS[0], YPOS[1]))
+        self.assertFalse(self.table.covers(XPOS[1] + 1.0, YPOS[0]))
+
+class LoadOrBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'ik.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTripAndRebuild(self):
+        built = TailKinematics.loadOrBuildIKTable(N, d, XPOS, YPOS, self.path, resolution=1.0)
+        loaded = TailKinematics.loadOrBuildIKTable(N, d, XPOS, YPOS, self.path, resolution=1.0)
+        self.assertTrue(numpy.array_equal(built.angles, loaded.angles))
+        self.assertEqual((loaded.resolution, loaded.iterations), (1.0, 10))
+        finer = TailKinematics.loadOrBuildIKTable(N, d, XPOS, YPOS, self.path, resolution=0.5)
+        self.assertEqual(len(finer.xs), 31)
+        TailKinematics.loadOrBuildIKTable(N, d, XPOS, YPOS, self.path, resolution=0.5, iterations=5)
+        self.assertEqual(TailKinematics.IKTable.load(self.path).iterations, 5)
+
+class QuantizedLRUCacheTest(unittest.TestCase):
+    def testSnapAndEvict(self):
+        cache = TailKinematics.QuantizedLRUCache(size=2, step=0.1)
+        cache.put(1.0, 2.0, 'a')
+        self.assertEqual(cache.get(1.04, 1.96), 'a')
+        cache.put(3.0, 3.0, 'b')
+        cache.put(4.0, 4.0, 'c') #Evicts a, the least recently used
+        self.assertIsNone(cache.get(1.0, 2.0))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+class FabrikSolverTest(unittest.TestCase):
+    def bends(self, solver):
+        dirs = solver.joints[1:] - solver.joints[:-1]
+        dirs /= numpy.sqrt((dirs**2).sum(axis=1))[:,None]
+        return numpy.arccos(numpy.clip((dirs[1:]*dirs[:-1]).sum(axis=1), -1.0, 1.0))
+
+    def testReachesTarget(self):
+        solver = TailKinematics.FabrikSolver([(0, 1, 0)]*N)
+        solver.solve((-8.0, 18.0, 0.0))
+        self.assertLessEqual(solver.residual, solver.tolerance)
+
+    def testLimitedSolveConverges(self):
+        solver = TailKinematics.FabrikSolver([(0, 1, 0)]*N, maxBend=0.3)
+        solver.solve((-15.0, 10.0, 0.0))
+        solver.solve((-8.0, 18.0, 0.0))
+        self.assertLess(solver.residual, 0.01)
+        self.assertLessEqual(self.bends(solver).max(), 0.3 + 1e-9)
+
+    def testTargetOnJointStaysFinite(self):
+        solver = TailKinematics.FabrikSolver([(0, 1, 0)]*5)
+        quats = solver.solve(tuple(solver.joints[4]))
+        self.assertTrue(numpy.isfinite(quats).all())
+        self.assertTrue(numpy.isfinite(solver.joints).all())
+
+    def testOrientationsAreUnit(self):
+        solver = TailKinematics.FabrikSolver([(0, 1, 0), (0, 2, 0), (0, 0.5, 0)])
+        quats = solver.solve((1.0, 2.0, 0.5))
+        self.assertTrue(numpy.allclose((quats**2).sum(axis=1), 1.0))
+
+class CriticallyDampedFollowerTest(unittest.TestCase):
+    def testFrameSplitInvariant(self):
+        a = TailKinematics.CriticallyDampedFollower((0.0, 0.0))
+        b = TailKinematics.CriticallyDampedFollower((0.0, 0.0))
+        a.target[...] = b.target[...] = (1.0, -1.0)
+        a.update(0.1)
+        for i in range(10):
+            b.update(0.01)
+        self.assertTrue(numpy.allclose(a.value, b.value))
+        for i in range(100):
+            a.update(0.05)
+        self.assertTrue(a.settled())
+
+if __name__ == '__main__':
+    unittest.main()
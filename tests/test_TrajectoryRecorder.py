@@ -0,0 +1,52 @@
+"""TrajectoryRecorder round trips through readRecording."""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from TrajectoryRecorder import TrajectoryRecorder, readRecording
+
+FIELDS = [('time', 'f8'), ('phase', 'label'), ('vx', 'f4')]
+
+class TrajectoryRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTripAcrossChunks(self):
+        recorder = TrajectoryRecorder(self.path, FIELDS, chunk=4)
+        phases = ['baseline', 'task', 'task', 'stopcue']*3
+        for k, phase in enumerate(phases):
+            recorder.append((k*0.02, phase, k*0.5))
+        recorder.close()
+        data, labels = readRecording(self.path)
+        self.assertEqual(len(data['time']), len(phases))
+        self.assertTrue(numpy.allclose(data['time'], numpy.arange(len(phases))*0.02))
+        self.assertTrue(numpy.allclose(data['vx'], numpy.arange(len(phases))*0.5))
+        self.assertEqual([labels['phase'][c] for c in data['phase']], phases)
+        self.assertEqual(os.path.getsize(os.path.join(self.path, 'vx.bin')), len(phases)*4) #Trimmed on close
+
+    def testReadDuringRun(self):
+        recorder = TrajectoryRecorder(self.path, FIELDS, chunk=4, headerInterval=3)
+        for k in range(10):
+            recorder.append((k, 'task' if k < 7 else 'stopcue', k))
+        data, labels = readRecording(self.path)
+        self.assertGreaterEqual(len(data['time']), 10 - 2) #At most headerInterval - 1 rows uncounted
+        self.assertEqual(labels['phase'], ['task', 'stopcue']) #New labels are published at once
+        self.assertTrue(numpy.array_equal(data['time'], numpy.arange(len(data['time']))))
+        recorder.close()
+        self.assertEqual(len(readRecording(self.path)[0]['time']), 10)
+
+    def testEmpty(self):
+        TrajectoryRecorder(self.path, FIELDS).close()
+        data, labels = readRecording(self.path)
+        self.assertEqual(len(data['vx']), 0)
+        self.assertEqual(data['vx'].dtype, numpy.dtype('f4'))
+
+if __name__ == '__main__':
+    unittest.main()